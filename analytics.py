@@ -0,0 +1,165 @@
+import html
+import loss
+from pymongo import UpdateOne
+
+
+# Rollup dimensions, in the order they are shown on /analytics
+DIMENSIONS = ['year', 'month', 'category', 'infrastructure', 'geography']
+
+# dimension -> (section title, key column title)
+DIMENSION_TITLES = {'year': ('By year', 'Year'),
+                    'month': ('By month', 'Month'),
+                    'category': ('By category', 'Category'),
+                    'infrastructure': ('By platform', 'Platform / infrastructure'),
+                    'geography': ('By geography', 'Geography')}
+
+# Fields a post's rollup buckets depend on
+POST_FIELDS = ['incident_time_initial_compromise',
+               'incident_time_incident_reported',
+               'incident_categories', 'ttp_resource_infrastructure',
+               'description_geographical', 'loss_usd',
+               'loss_usd_amount']
+
+UNKNOWN = 'Unknown'
+
+
+def loss_usd(post):
+    """
+    Returns the USD loss of a post as a float, 0 when it has none.
+
+    Posts stored before the typed loss fields existed are parsed the same
+    way, so backfilling them does not change the rollups.
+    """
+    if 'loss_usd_amount' in post:
+        amount = post['loss_usd_amount']
+    else:
+        amount = loss.parse_loss(post.get('loss_usd'))[0]
+    return amount or 0.0
+
+
+def label(value):
+    value = html.unescape(value).strip() if value else ''
+    return value or UNKNOWN
+
+
+def buckets(post):
+    """
+    Returns the (dimension, key) buckets a post is counted in.
+    """
+    when = post.get('incident_time_initial_compromise') or \
+        post.get('incident_time_incident_reported')
+    return [('year', when.strftime('%Y') if when else UNKNOWN),
+            ('month', when.strftime('%Y-%m') if when else UNKNOWN),
+            ('category', label(post.get('incident_categories'))),
+            ('infrastructure', label(post.get('ttp_resource_infrastructure'))),
+            ('geography', label(post.get('description_geographical')))]
+
+
+class Analytics:
+    """
+    Materialized incident count and USD loss rollups.
+
+    Each (dimension, key) bucket is one document in ANALYTICS_COLLECTION.
+    Post writes apply the difference between the old and the new version
+    of the post with $inc, so reading the rollups never touches the posts
+    collection.
+    """
+
+    def __init__(self, default_config):
+        self.collection = default_config['ANALYTICS_COLLECTION']
+        self.posts_collection = default_config['POSTS_COLLECTION']
+
+    @staticmethod
+    def bucket_id(dimension, key):
+        return '%s:%s' % (dimension, key)
+
+    def make_deltas(self, old_post=None, new_post=None):
+        """
+        Returns {(dimension, key): [count, loss]} changes for replacing
+        old_post with new_post, either of which may be None.
+        """
+        deltas = {}
+        for post, sign in ((old_post, -1), (new_post, 1)):
+            if post is None:
+                continue
+            usd = loss_usd(post)
+            for bucket in buckets(post):
+                delta = deltas.setdefault(bucket, [0, 0.0])
+                delta[0] += sign
+                delta[1] += sign * usd
+        return dict((bucket, delta) for bucket, delta in deltas.items()
+                    if delta != [0, 0.0])
+
+    def apply(self, old_post=None, new_post=None):
+        """
+        Updates the rollups for a created (old_post None), edited or
+        deleted (new_post None) post.
+        """
+        self.apply_deltas(self.make_deltas(old_post, new_post))
+
+    def apply_many(self, posts):
+        """
+        Adds newly inserted posts to the rollups with one bulk write.
+        """
+        deltas = {}
+        for post in posts:
+            for bucket, delta in self.make_deltas(new_post=post).items():
+                total = deltas.setdefault(bucket, [0, 0.0])
+                total[0] += delta[0]
+                total[1] += delta[1]
+        self.apply_deltas(deltas)
+
+    def apply_deltas(self, deltas):
+        if not deltas:
+            return
+        requests = []
+        for (dimension, key), (count, usd) in deltas.items():
+            requests.append(UpdateOne(
+                {'_id': self.bucket_id(dimension, key)},
+                {'$set': {'dimension': dimension, 'key': key},
+                 '$inc': {'count': count, 'loss_usd': usd}},
+                upsert=True))
+        self.collection.bulk_write(requests, ordered=False)
+
+    def rebuild(self, batch_size=500):
+        """
+        Recomputes every rollup from the posts collection. Returns the
+        number of posts counted.
+        """
+        deltas = {}
+        posts = 0
+        cursor = self.posts_collection.find(
+            {}, dict.fromkeys(POST_FIELDS, 1)).batch_size(batch_size)
+        for post in cursor:
+            posts += 1
+            for bucket, delta in self.make_deltas(new_post=post).items():
+                total = deltas.setdefault(bucket, [0, 0.0])
+                total[0] += delta[0]
+                total[1] += delta[1]
+
+        self.collection.delete_many({})
+        self.apply_deltas(deltas)
+        return posts
+
+    def get_rollups(self):
+        """
+        Returns a list with one dictionary per dimension, in DIMENSIONS
+        order, holding 'dimension', 'title', 'column' and 'rows'. Rows
+        have 'key', 'count' and 'loss_usd', time dimensions are sorted
+        newest first and the others by count, largest first.
+        """
+        rows = dict((dimension, []) for dimension in DIMENSIONS)
+        for bucket in self.collection.find({'count': {'$gt': 0}}):
+            if bucket['dimension'] in rows:
+                rows[bucket['dimension']].append(bucket)
+
+        rollups = []
+        for dimension in DIMENSIONS:
+            if dimension in ('year', 'month'):
+                rows[dimension].sort(key=lambda row: row['key'], reverse=True)
+            else:
+                rows[dimension].sort(key=lambda row: (-row['count'], row['key']))
+            title, column = DIMENSION_TITLES[dimension]
+            rollups.append({'dimension': dimension, 'title': title,
+                            'column': column, 'rows': rows[dimension]})
+        return rollups
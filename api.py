@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import html
+import json
+from bson.objectid import ObjectId
+
+
+# Bumped whenever the JSON layout changes, it is part of the URLs and of
+# every ETag so clients never revalidate against another layout
+API_VERSION = 'v1'
+
+# Largest page a listing request may ask for
+MAX_LIMIT = 100
+
+# Fields read to compute the ETag of a page without reading the posts
+VERSION_FIELDS = ['date', 'modified']
+
+# Fields of an incident in API responses
+FIELDS = ['incident_title', 'incident_description', 'incident_preview',
+          'ttp_resource_infrastructure', 'incident_categories',
+          'ttp_description', 'ttp_exploits_targets',
+          'incident_time_initial_compromise', 'incident_time_incident_reported',
+          'loss_crypto', 'loss_usd', 'loss_usd_amount', 'loss_crypto_amount',
+          'loss_crypto_asset', 'description_geographical', 'country_codes',
+          'references', 'tags', 'permalink', 'author', 'date', 'modified']
+
+# Text fields stored HTML escaped by Post.validate_post_data
+ESCAPED_FIELDS = frozenset(['incident_title', 'incident_description',
+                            'incident_preview', 'ttp_resource_infrastructure',
+                            'incident_categories', 'ttp_description',
+                            'ttp_exploits_targets', 'loss_crypto', 'loss_usd',
+                            'description_geographical', 'references'])
+
+
+def post_version(post):
+    """
+    Returns the version of a post, its last modified time.
+    """
+    return post.get('modified') or post.get('date')
+
+
+def make_etag(*parts):
+    """
+    Returns a strong ETag value for a response built from parts, which are
+    stringified and hashed along with the API version.
+    """
+    digest = hashlib.sha1(API_VERSION.encode('utf-8'))
+    for part in parts:
+        digest.update(b'\0' + str(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def posts_etag(posts, *parts):
+    """
+    Returns the ETag of a list of posts read with at least VERSION_FIELDS,
+    it changes when any of them is edited, deleted or replaced on the page.
+    """
+    return make_etag(*(list(parts) + [(post['id'], post_version(post))
+                                      for post in posts]))
+
+
+def json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat() + 'Z'
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def serialize_post(post):
+    """
+    Maps a post onto its API representation, with the HTML escaping of the
+    text fields undone.
+    """
+    record = {'id': str(post.get('id') or post.get('_id'))}
+    for field in FIELDS:
+        value = post.get(field)
+        if field in ESCAPED_FIELDS and value:
+            value = html.unescape(value)
+        record[field] = json_value(value)
+    return record
+
+
+def dumps(data):
+    return json.dumps(data, sort_keys=True, default=json_value)
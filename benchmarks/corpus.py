@@ -0,0 +1,210 @@
+"""
+Seeded synthetic incident corpus for the benchmarks.
+
+Run from the project root:
+
+    python -m benchmarks.corpus --scale 100k --csv incidents.csv
+    python -m benchmarks.corpus --scale 100k --database incidentdb_bench
+
+Incidents are raw form input with the Post.validate_post_data fields,
+long markdown descriptions, skewed platform/category/tag popularity and
+dates spread over several years. The same --seed always gives the same
+corpus. --csv writes the /install upload layout (importer.COLUMNS),
+--database loads validated incidents straight into a scratch database.
+"""
+import argparse
+import csv
+import datetime
+import random
+import sys
+import time
+
+import importer
+import post
+from benchmarks import scratch
+
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+PLATFORMS = ['Ethereum', 'Bitcoin', 'EOS', 'Binance Smart Chain', 'Tron',
+             'Solana', 'Polygon', 'Ripple', 'Monero', 'Litecoin']
+CATEGORIES = ['Exchange Hack', 'Smart Contract', 'Phishing', 'Wallet Theft',
+              'Ponzi Scheme', 'Ransomware', 'Insider Theft', 'Oracle Manipulation']
+ATTACKS = ['Reentrancy', 'Private key leak', 'Integer overflow',
+           'Flash loan price manipulation', 'Compromised hot wallet',
+           'Social engineering', 'Front running', 'Access control bypass']
+TARGETS = ['Hot wallet', 'Token contract', 'Bridge', 'Lending pool',
+           'Custodial accounts', 'Multisig wallet', 'Mining pool']
+COUNTRIES = ['United States', 'South Korea', 'Japan', 'Singapore', 'China',
+             'United Kingdom', 'Hong Kong', 'Germany', 'Russia', 'Unknown']
+ASSETS = ['BTC', 'ETH', 'EOS', 'XRP', 'USDT', 'BNB', 'XMR']
+TAGS = ['defi', 'exchange', 'bridge', 'wallet', 'ico', 'nft', 'dao', 'mixer',
+        'stablecoin', 'lending', 'oracle', 'governance', 'mining', 'custody']
+
+WORDS = ('attacker funds contract wallet exchange withdrawal transaction '
+         'address private key deposit token liquidity pool bridge oracle '
+         'price validator signature multisig audit exploit vulnerability '
+         'patch users balance drained mempool block chain reorg gas fee '
+         'governance proposal flash loan collateral reserve hot cold '
+         'custody recovery bounty investigation report').split()
+
+START = datetime.datetime(2011, 1, 1)
+DAYS = (datetime.datetime(2019, 1, 1) - START).days
+
+
+def pick(rng, values):
+    """
+    Picks from values with Zipf like weights, the first ones being the
+    most common as on a real incident database.
+    """
+    return values[min(int(rng.paretovariate(1.2)) - 1, len(values) - 1)]
+
+
+def sentence(rng, words=None):
+    words = words or rng.randint(8, 24)
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng):
+    return ' '.join(sentence(rng) for _ in range(rng.randint(3, 8)))
+
+
+def make_description(rng, index):
+    """
+    Returns a markdown description of a few KB using the markup the
+    incident extensions handle: headings, emphasis, lists, links, quotes
+    and code blocks.
+    """
+    parts = ['## Summary', paragraph(rng),
+             'The **%s** was drained by *%s*, see [the report](https://example.com/%d).'
+             % (rng.choice(TARGETS).lower(), rng.choice(ATTACKS).lower(), index)]
+    for _ in range(rng.randint(2, 6)):
+        kind = rng.random()
+        if kind < 0.4:
+            parts.append(paragraph(rng))
+        elif kind < 0.6:
+            parts.append('\n'.join('- ' + sentence(rng, rng.randint(4, 10))
+                                   for _ in range(rng.randint(3, 6))))
+        elif kind < 0.75:
+            parts.append('~~ %s ~~' % sentence(rng))
+        elif kind < 0.9:
+            parts.append('[code]\nfunction withdraw(uint amount) {\n'
+                         '    msg.sender.call.value(amount)();\n'
+                         '    balances[msg.sender] -= amount;\n}\n[/code]')
+        else:
+            parts.append('### Timeline\n\n' + '\n'.join(
+                '%d. %s' % (step + 1, sentence(rng, 6)) for step in range(rng.randint(3, 8))))
+    return '\n\n'.join(parts)
+
+
+def make_loss(rng):
+    amount = round(rng.lognormvariate(12, 2.5))
+    asset = rng.choice(ASSETS)
+    usd = amount * rng.choice([1, 10, 200, 6000])
+    if usd >= 10 ** 6:
+        loss_usd = '$%.1fm' % (usd / 10.0 ** 6)
+    else:
+        loss_usd = '$%s' % '{:,}'.format(usd)
+    return '%s %s' % ('{:,}'.format(amount), asset), loss_usd
+
+
+def make_incident(rng, index):
+    """
+    Returns the raw form input of one incident.
+    """
+    compromised = START + datetime.timedelta(days=rng.randrange(DAYS))
+    reported = compromised + datetime.timedelta(days=rng.randint(0, 30))
+    platform = pick(rng, PLATFORMS)
+    category = pick(rng, CATEGORIES)
+    loss_crypto, loss_usd = make_loss(rng)
+    return {'incident_title': '%s %s #%d' % (platform, category, index),
+            'incident_description': make_description(rng, index),
+            'ttp_resource_infrastructure': platform,
+            'incident_categories': category,
+            'ttp_description': rng.choice(ATTACKS),
+            'ttp_exploits_targets': rng.choice(TARGETS),
+            'incident_time_initial_compromise': compromised.strftime('%m/%d/%Y'),
+            'incident_time_incident_reported': reported.strftime('%m/%d/%Y'),
+            'loss_crypto': loss_crypto,
+            'loss_usd': loss_usd,
+            'description_geographical': pick(rng, COUNTRIES),
+            'references': 'https://example.com/incidents/%d' % index,
+            'advanced': None,
+            # not part of the form, set by load()
+            'tags': sorted(set(pick(rng, TAGS) for _ in range(rng.randint(1, 3)))),
+            'reported': reported}
+
+
+def generate(count, seed=0):
+    """
+    Yields count incidents, the same ones for the same seed.
+    """
+    rng = random.Random(seed)
+    for index in range(count):
+        yield make_incident(rng, index)
+
+
+def write_csv(stream, incidents):
+    """
+    Writes incidents in the /install upload layout, returns the count.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(importer.COLUMNS)
+    written = 0
+    for incident in incidents:
+        writer.writerow([incident[column] for column in importer.COLUMNS])
+        written += 1
+    return written
+
+
+def load(post_class, incidents, author, batch_size=1000):
+    """
+    Validates incidents and inserts them in batches with their tags and
+    with the report date as the post date, returns the count inserted.
+    """
+    inserted = 0
+    batch = []
+    for incident in incidents:
+        tags = incident.pop('tags')
+        reported = incident.pop('reported')
+        incident['author'] = author
+        post_data = post_class.validate_post_data(incident)
+        post_data['tags'] = tags
+        post_data['date'] = post_data['modified'] = reported
+        batch.append(post_data)
+        if len(batch) >= batch_size:
+            inserted += len(post_class.create_new_posts(batch)['data'])
+            batch = []
+    if batch:
+        inserted += len(post_class.create_new_posts(batch)['data'])
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k')
+    parser.add_argument('--count', type=int, help='overrides --scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', type=argparse.FileType('w'),
+                        help='write the incidents as an /install CSV upload')
+    parser.add_argument('--database', help='load the incidents into this scratch database')
+    parser.add_argument('--author', default='admin')
+    args = parser.parse_args(argv)
+    if not args.csv and not args.database:
+        parser.error('give --csv and/or --database')
+
+    count = args.count or SCALES[args.scale]
+    start = time.perf_counter()
+    if args.csv:
+        write_csv(args.csv, generate(count, args.seed))
+        args.csv.close()
+    if args.database:
+        connection, default_config = scratch.connect(args.database)
+        count = load(post.Post(default_config), generate(count, args.seed), args.author)
+    print('%d incidents in %.1fs' % (count, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Render time of incident markdown on large and adversarial inputs.
+
+Run from the project root:
+
+    python -m benchmarks.markdown_bench [--output markdown.json]
+
+Every case is rendered with markdown_render.render at several sizes and
+the best time of --repeat runs is reported in milliseconds per KB. A
+linear renderer keeps ms/KB flat as the size grows.
+"""
+import argparse
+import json
+import sys
+import time
+
+import markdown_render
+
+
+PROSE = ('The attacker drained the **hot wallet** through a reentrancy bug '
+         'in the withdraw function, see [the report](https://example.com) '
+         'and --the old-- ~~updated~~ figures. [code] call.value()() '
+         '[/code]\n\n')
+
+# name -> text repeated up to the target size
+CASES = {
+    'prose': PROSE,
+    'unclosed_code': '[code] ',
+    'unclosed_strike': '-- x ',
+    'unclosed_quote': '~~ x ',
+    'dash_runs': '---x',
+    'mixed_openers': '[code]--~~[gist]',
+    'long_line_no_markup': 'a' * 64 + ' ',
+}
+
+SIZES_KB = (1, 10, 50)
+
+
+def make_input(unit, size_kb):
+    size = size_kb * 1024
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def time_render(text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        markdown_render.render(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(repeat=3, sizes=SIZES_KB):
+    results = {'render_version': markdown_render.RENDER_VERSION,
+               'cases': {}}
+    for name, unit in sorted(CASES.items()):
+        rows = []
+        for size_kb in sizes:
+            seconds = time_render(make_input(unit, size_kb), repeat)
+            rows.append({'size_kb': size_kb,
+                         'ms': round(seconds * 1000, 3),
+                         'ms_per_kb': round(seconds * 1000 / size_kb, 3)})
+        results['cases'][name] = rows
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES_KB,
+                        help='input sizes in KB')
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.sizes)
+    for name, rows in sorted(results['cases'].items()):
+        print('%-20s %s' % (name, '  '.join(
+            '%dKB %.3fms/KB' % (row['size_kb'], row['ms_per_kb']) for row in rows)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""
+Query plan check of every query shape the data layer issues.
+
+Run from the project root against a MongoDB server, e.g. before deploy:
+
+    python -m benchmarks.query_plans [--incidents 2000] [--strict]
+
+A scratch --database is seeded with benchmarks.corpus incidents, a few
+users and the settings document, and brought to the current schema and
+indexes with migrations.Migrations. Each shape below then calls the real
+Post, User or Settings method while the commands it sends are captured,
+and every find, aggregate, count and distinct is run again through
+explain. The chosen index, keys examined and documents examined are
+printed per shape. A COLLSCAN or in-memory SORT stage fails the check
+(exit status 1) unless it reads a collection in BOUNDED_COLLECTIONS.
+Plans matching an entry of KNOWN_SCANS, i.e. the shape, the collection
+and the kind of filter it was run with, are scans the data layer can't
+avoid yet: they are reported as warnings with their reason, and fail the
+check too with --strict.
+"""
+import argparse
+import sys
+import threading
+
+import flask
+from pymongo import monitoring
+
+import facets
+import migrations
+import pagination
+import post
+import settings
+import user
+from benchmarks import corpus, scratch
+
+
+# Commands that run a query plan
+EXPLAINED_COMMANDS = frozenset(['find', 'aggregate', 'count', 'distinct'])
+
+# Command fields added by the driver that explain does not take
+DRIVER_FIELDS = frozenset(['lsid', 'txnNumber', '$clusterTime', '$db',
+                           '$readPreference', 'readConcern', 'writeConcern'])
+
+# Plan stages that fail the check
+FAILING_STAGES = frozenset(['COLLSCAN', 'SORT'])
+
+# Stages that read the _id index without naming it
+ID_STAGES = frozenset(['IDHACK', 'EXPRESS_IXSCAN', 'EXPRESS_CLUSTERED_IXSCAN'])
+
+
+def is_unfiltered(query):
+    return not query
+
+
+def is_regex_search(query):
+    """
+    Whether query is the Post.get_condition search alone, an $or of
+    case insensitive regexes, without a tag or facet filter.
+    """
+    return list(query) == ['$or'] and all(
+        len(clause) == 1 and isinstance(value, dict) and
+        set(value) <= {'$regex', '$options'}
+        for clause in query['$or'] for value in clause.values())
+
+
+# (shape name, collection, filter test, why the scan is not fixed yet),
+# reported as warnings. A scan with any other filter, e.g. the same shape
+# narrowed by facets, fails
+KNOWN_SCANS = [
+    ('get_facets', 'posts', is_unfiltered,
+     'the unfiltered facet counts read every incident, they are cached until '
+     'the next write'),
+    ('get_total_count search (regex)', 'posts', is_regex_search,
+     'counting unanchored regex matches reads every incident, it stops after '
+     'SEARCH_COUNT_MS; enable text search instead'),
+]
+
+# Collections holding a fixed handful of documents, scanning them is fine
+BOUNDED_COLLECTIONS = {'settings': 'holds the single settings document'}
+
+USERS = 3
+
+
+class CommandCapture(monitoring.CommandListener):
+    """
+    Keeps the query commands started by the current thread while active.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start(self):
+        self.local.commands = []
+
+    def stop(self):
+        commands, self.local.commands = getattr(self.local, 'commands', None), None
+        return commands or []
+
+    def started(self, event):
+        commands = getattr(self.local, 'commands', None)
+        if commands is not None and event.command_name in EXPLAINED_COMMANDS:
+            commands.append((event.database_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def walk(node, found):
+    """
+    Collects the stages, index names and examined counts of an explain
+    output, skipping the plans the optimizer rejected.
+    """
+    if isinstance(node, dict):
+        stage = node.get('stage')
+        if isinstance(stage, str):
+            found['stages'].append(stage)
+            if node.get('indexName'):
+                found['indexes'].add(node['indexName'])
+            elif stage in ID_STAGES:
+                found['indexes'].add('_id_')
+        for key in ('totalKeysExamined', 'totalDocsExamined'):
+            if isinstance(node.get(key), int):
+                found[key] += node[key]
+        for key, value in node.items():
+            if key not in ('rejectedPlans', 'allPlansExecution'):
+                walk(value, found)
+    elif isinstance(node, list):
+        for item in node:
+            walk(item, found)
+    return found
+
+
+def query_filter(command):
+    """
+    Returns the filter of a find, count or distinct command, or the
+    leading $match of an aggregate (count_documents sends one).
+    """
+    for key in ('filter', 'query'):
+        if key in command:
+            return command[key] or {}
+    pipeline = command.get('pipeline') or [{}]
+    return pipeline[0].get('$match', {})
+
+
+def plan_status(name, plan):
+    """
+    Returns the (status, reason) of a plan, status one of 'ok', 'allowed'
+    (bounded collection), 'WARN' (known scan) and 'FAIL'.
+    """
+    if not plan['failing']:
+        return 'ok', None
+    if plan['collection'] in BOUNDED_COLLECTIONS:
+        return 'allowed', BOUNDED_COLLECTIONS[plan['collection']]
+    for shape, collection, test, reason in KNOWN_SCANS:
+        if shape == name and collection == plan['collection'] and test(plan['filter']):
+            return 'WARN', reason
+    return 'FAIL', None
+
+
+def explain(client, database_name, command):
+    command = dict((key, value) for key, value in command.items()
+                   if key not in DRIVER_FIELDS)
+    output = client[database_name].command('explain', command, verbosity='executionStats')
+    found = walk(output, {'stages': [], 'indexes': set(),
+                          'totalKeysExamined': 0, 'totalDocsExamined': 0})
+    collection = command.get(next(iter(command)))
+    return {'collection': collection if isinstance(collection, str) else None,
+            'command': next(iter(command)),
+            'filter': query_filter(command),
+            'stages': found['stages'],
+            'indexes': sorted(found['indexes']),
+            'keys_examined': found['totalKeysExamined'],
+            'docs_examined': found['totalDocsExamined'],
+            'failing': sorted(set(found['stages']) & FAILING_STAGES)}
+
+
+def seed(default_config, incidents, seed_value):
+    """
+    Fills the scratch database and builds its indexes, returns a sample
+    incident for the lookups.
+    """
+    post_class = post.Post(default_config)
+    user_class = user.User(default_config)
+    corpus.load(post_class, corpus.generate(incidents, seed_value), 'admin')
+    for index in range(USERS):
+        user_class.save_user({'_id': 'admin' if index == 0 else 'user%d' % index,
+                              'email': 'user%d@localhost.com' % index,
+                              'new_pass': 'password', 'new_pass_again': 'password',
+                              'super': index == 0, 'update': False})
+    default_config['SETTINGS_COLLECTION'].insert_one({
+        'title': 'Query plans', 'description': '', 'per_page': 15,
+        'text_search': 1, 'installed': True})
+    migrations.Migrations(default_config).run()
+    return default_config['POSTS_COLLECTION'].find_one(
+        {'tags': {'$type': 'string'}}, sort=[('date', -1)])
+
+
+def make_shapes(post_class, user_class, settings_class, sample):
+    """
+    Returns (name, call) pairs covering the reads of the data layer.
+    """
+    filters = facets.parse_filters({'category': sample['incident_categories'],
+                                    'since': '2013', 'until': '2017'})[0]
+    platform = facets.parse_filters({'platform': sample['ttp_resource_infrastructure']})[0]
+    country = facets.parse_filters({'country': sample['country_codes'][0]})[0] \
+        if sample.get('country_codes') else {}
+    tag = sample['tags'][0]
+    after = pagination.decode_cursor(post_class.get_posts(15, 0)['next_cursor'])
+    term = sample['incident_title'].split()[0]
+
+    def with_search(enabled, call):
+        def run():
+            previous = post_class.config['SEARCH']
+            post_class.config['SEARCH'] = enabled
+            try:
+                return call()
+            finally:
+                post_class.config['SEARCH'] = previous
+        return run
+
+    def get_config():
+        settings_class.invalidate_cache()
+        return settings_class.get_config()
+
+    def is_installed():
+        # Reads the settings again instead of the latch, and keeps the
+        # result in the session of a request
+        settings_class.installed = False
+        app = flask.Flask(__name__)
+        app.secret_key = 'query-plans'
+        with app.test_request_context():
+            return settings_class.is_installed()
+
+    return [
+        ('get_posts', lambda: post_class.get_posts(15, 0)),
+        ('get_posts page 3', lambda: post_class.get_posts(15, 30)),
+        ('get_posts after cursor', lambda: post_class.get_posts(15, 0, after=after)),
+        ('get_posts before cursor', lambda: post_class.get_posts(15, 0, before=after)),
+        ('get_posts tag', lambda: post_class.get_posts(15, 0, tag=tag)),
+        ('get_posts category and dates', lambda: post_class.get_posts(15, 0, filters=filters)),
+        ('get_posts platform', lambda: post_class.get_posts(15, 0, filters=platform)),
+        ('get_posts country', lambda: post_class.get_posts(15, 0, filters=country)),
+        ('get_posts search (text index)', with_search(
+            True, lambda: post_class.get_posts(15, 0, search=term))),
+        ('get_posts search (regex)', with_search(
+            False, lambda: post_class.get_posts(15, 0, search=term))),
+        ('get_total_count', lambda: post_class.get_total_count()),
+        ('get_total_count tag', lambda: post_class.get_total_count(tag=tag)),
+        ('get_total_count filters', lambda: post_class.get_total_count(filters=filters)),
+        ('get_total_count search (regex)', lambda: post_class.get_total_count(search=term)),
+        ('get_facets', lambda: post_class.get_facets()),
+        ('get_facets filters', lambda: post_class.get_facets(filters)),
+        ('get_post_by_permalink', lambda: post_class.get_post_by_permalink(sample['permalink'])),
+        ('get_post_by_id', lambda: post_class.get_post_by_id(str(sample['_id']))),
+        ('get_tags', lambda: post_class.get_tags()),
+        ('get_top_losses', lambda: post_class.get_top_losses()),
+        ('get_users', lambda: user_class.get_users()),
+        ('get_user', lambda: user_class.get_user('admin')),
+        ('login', lambda: user_class.login('admin', 'password')),
+        ('Settings.get_config', get_config),
+        ('Settings.is_installed', is_installed),
+    ]
+
+
+def check(client, post_class, user_class, settings_class, sample, capture):
+    """
+    Runs and explains every shape, returns (name, plans) rows.
+    """
+    rows = []
+    for name, call in make_shapes(post_class, user_class, settings_class, sample):
+        post_class.cache.invalidate()
+        capture.start()
+        try:
+            call()
+        finally:
+            commands = capture.stop()
+
+        rows.append((name, [explain(client, database_name, command)
+                            for database_name, command in commands]))
+    return rows
+
+
+def shapes_with(rows, status):
+    return [name for name, plans in rows
+            if any(plan_status(name, plan)[0] == status for plan in plans)]
+
+
+def print_rows(rows):
+    print('%-34s %-10s %-9s %-44s %8s %8s' % (
+        'shape', 'status', 'command', 'index', 'keys', 'docs'))
+    for name, plans in rows:
+        if not plans:
+            print('%-34s %-10s (no query, served from memory)' % (name, 'ok'))
+        for plan in plans:
+            status, reason = plan_status(name, plan)
+            print('%-34s %-10s %-9s %-44s %8d %8d' % (
+                name, status, plan['command'],
+                ', '.join(plan['indexes']) or '-', plan['keys_examined'],
+                plan['docs_examined']))
+            if plan['failing']:
+                print('%-34s %s on %s%s' % ('', ' and '.join(plan['failing']),
+                                            plan['collection'],
+                                            ': ' + reason if reason else ''))
+            name = ''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--incidents', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default='incidentdb_plans',
+                        help='scratch database, dropped before and after')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail on the KNOWN_SCANS warnings too')
+    args = parser.parse_args(argv)
+
+    # Registered before the scratch connection creates its client
+    capture = CommandCapture()
+    monitoring.register(capture)
+
+    connection, default_config = scratch.connect(args.database)
+    scratch.drop(connection)
+    try:
+        sample = seed(default_config, args.incidents, args.seed)
+        post_class = post.Post(default_config)
+        rows = check(connection.get_client(), post_class, user.User(default_config),
+                     settings.Settings(default_config), sample, capture)
+    finally:
+        scratch.drop(connection)
+
+    print_rows(rows)
+    failed = shapes_with(rows, 'FAIL')
+    warned = shapes_with(rows, 'WARN')
+    if warned:
+        print('\nWARNING: %d shapes scan every incident: %s' % (len(warned), ', '.join(warned)))
+    if failed:
+        print('\n%d shapes need an index: %s' % (len(failed), ', '.join(failed)))
+        return 1
+    if warned and args.strict:
+        return 1
+    if not warned:
+        print('\nAll %d shapes use an index.' % len(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Latency and throughput of the public routes on a synthetic corpus.
+
+Run from the project root against a MongoDB server:
+
+    python -m benchmarks.routes_bench [--scale 1k] [--output baseline.json]
+    python -m benchmarks.routes_bench --compare baseline.json
+
+The benchmarks.corpus incidents are loaded into the scratch --database,
+the first --import-rows of them through the /install CSV upload, which
+is timed, and the rest in bulk. Every route is then requested through
+the Flask test client, --warmup times untimed and --requests times timed
+on --concurrency threads, and its p50/p95/p99 latency and throughput are
+reported. The page cache is off unless --page-cache is given, so the
+numbers are those of the routes and not of the cache. --compare prints
+the change against an earlier --output baseline.
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+ROUTES = ['index', 'posts_by_tag', 'single_post', 'search_results', 'recent_feed']
+
+AUTHOR = 'admin'
+PASSWORD = 'benchmark'
+CSRF_TOKEN = 'benchmark'
+
+
+def load_app(database_name):
+    """
+    Imports web.py with every collection in database_name.
+    """
+    os.environ['MONGODB_DATABASE'] = database_name
+    import config
+    if config.CONNECTION.database_name != database_name:
+        raise RuntimeError('config was imported before the scratch database was set')
+    import web
+    return web
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    index = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3)
+    return {'requests': len(latencies), 'errors': errors,
+            'p50_ms': ms(percentile(latencies, .50)),
+            'p95_ms': ms(percentile(latencies, .95)),
+            'p99_ms': ms(percentile(latencies, .99)),
+            'mean_ms': ms(sum(latencies) / len(latencies)),
+            'max_ms': ms(latencies[-1]),
+            'throughput_rps': round(len(latencies) / seconds, 1)}
+
+
+def install(web, incidents):
+    """
+    Installs the blog through /install with incidents as the CSV upload,
+    returns the timing of the upload.
+    """
+    from benchmarks import corpus
+
+    stream = io.StringIO()
+    rows = corpus.write_csv(stream, incidents)
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['_csrf_token'] = CSRF_TOKEN
+
+    start = time.perf_counter()
+    response = client.post('/install', content_type='multipart/form-data', data={
+        '_csrf_token': CSRF_TOKEN,
+        'user-id': AUTHOR, 'user-email': 'admin@localhost.com',
+        'user-new-password': PASSWORD, 'user-new-password-again': PASSWORD,
+        'blog-title': 'Benchmark', 'blog-description': 'Synthetic incidents',
+        'blog-perpage': '15', 'blog-text-search': '1',
+        'file-upload': (io.BytesIO(stream.getvalue().encode('utf-8')), 'incidents.csv')})
+    seconds = time.perf_counter() - start
+    if response.status_code != 302:
+        raise RuntimeError('/install answered %d' % response.status_code)
+    return {'rows': rows, 'seconds': round(seconds, 3),
+            'rows_per_second': round(rows / seconds, 1) if rows else None}
+
+
+def make_urls(web, rng, count):
+    """
+    Returns count URLs of each route, picked from the loaded corpus.
+    """
+    from benchmarks import corpus
+
+    permalinks = [post['permalink'] for post in web.postClass.collection.aggregate([
+        {'$sample': {'size': 500}}, {'$project': {'permalink': 1}}])]
+    pools = {
+        'index': ['/'] * 4 + ['/page-%d' % page for page in range(2, 6)],
+        'posts_by_tag': ['/tag/%s' % tag for tag in
+                         web.postClass.collection.distinct('tags')],
+        'single_post': ['/incident/%s' % permalink for permalink in permalinks],
+        'search_results': ['/q/%s' % word for word in corpus.WORDS] +
+                          ['/q/%s %s' % pair for pair in zip(corpus.WORDS, corpus.WORDS[1:])],
+        'recent_feed': ['/recent_feed'],
+    }
+    return dict((route, [rng.choice(pools[route]) for _ in range(count)])
+                for route in ROUTES)
+
+
+def bench_route(web, urls, warmup, concurrency):
+    """
+    Requests urls anonymously on concurrency threads, each with its own
+    test client, and returns the summary of the timed requests.
+    """
+    local = threading.local()
+
+    def get(url):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = web.app.test_client()
+        start = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        return time.perf_counter() - start, response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(get, urls[:warmup]))
+        start = time.perf_counter()
+        outcomes = list(executor.map(get, urls[warmup:]))
+        seconds = time.perf_counter() - start
+    latencies = [elapsed for elapsed, ok in outcomes]
+    errors = sum(1 for elapsed, ok in outcomes if not ok)
+    return summarize(latencies, errors, seconds)
+
+
+def run(args):
+    from benchmarks import corpus, scratch
+
+    web = load_app(args.database)
+    if not args.page_cache:
+        web.pageCache.backends = []
+        web.feedCache.backends = []
+
+    count = args.count or corpus.SCALES[args.scale]
+    import_rows = min(args.import_rows, count)
+    scratch.drop(web.app.config['CONNECTION'])
+
+    incidents = corpus.generate(count, args.seed)
+    results = {'meta': {'revision': git_revision(),
+                        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+                        'python': platform.python_version(),
+                        'incidents': count, 'seed': args.seed,
+                        'requests': args.requests, 'concurrency': args.concurrency,
+                        'page_cache': args.page_cache},
+               'install_import': install(web, itertools.islice(incidents, import_rows)),
+               'routes': {}}
+    start = time.perf_counter()
+    corpus.load(web.postClass, incidents, AUTHOR)
+    results['meta']['load_seconds'] = round(time.perf_counter() - start, 3)
+
+    urls = make_urls(web, random.Random(args.seed), args.warmup + args.requests)
+    try:
+        for route in ROUTES:
+            results['routes'][route] = bench_route(web, urls[route], args.warmup,
+                                                   args.concurrency)
+    finally:
+        if not args.keep:
+            scratch.drop(web.app.config['CONNECTION'])
+    return results
+
+
+def print_results(results):
+    install = results['install_import']
+    print('install import: %d rows in %.3fs' % (install['rows'], install['seconds']))
+    print('%-16s %9s %9s %9s %9s %7s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'errors'))
+    for route, row in sorted(results['routes'].items()):
+        print('%-16s %9.2f %9.2f %9.2f %9.1f %7d' % (
+            route, row['p50_ms'], row['p95_ms'], row['p99_ms'],
+            row['throughput_rps'], row['errors']))
+
+
+def print_comparison(baseline, results):
+    def change(old, new):
+        return '%+.1f%%' % ((new - old) * 100.0 / old) if old else 'n/a'
+
+    print('against %s (%s)' % (baseline['meta'].get('revision'), baseline['meta'].get('date')))
+    for route, row in sorted(results['routes'].items()):
+        old = baseline['routes'].get(route)
+        if old is None:
+            continue
+        print('%-16s %s' % (route, '  '.join(
+            '%s %s' % (key[:-3], change(old[key], row[key]))
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'))))
+
+
+def main(argv=None):
+    from benchmarks import corpus
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(corpus.SCALES), default='1k')
+    parser.add_argument('--count', type=int, help='overrides --scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--import-rows', type=int, default=1000,
+                        help='incidents uploaded through /install, the rest are bulk loaded')
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--page-cache', action='store_true')
+    parser.add_argument('--database', default='incidentdb_bench',
+                        help='scratch database, dropped before and after')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the scratch database afterwards')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
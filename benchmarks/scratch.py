@@ -0,0 +1,38 @@
+"""
+Scratch databases for the benchmarks, so they never touch real data.
+"""
+import os
+
+import database
+
+
+def make_config(connection):
+    """
+    Returns a copy of config.py with every collection in the database of
+    connection.
+    """
+    # Imported here so benchmarks.routes_bench can pick the database of
+    # config.py through MONGODB_DATABASE before it is first imported
+    import config
+
+    default_config = dict((name, getattr(config, name)) for name in dir(config)
+                          if name.isupper())
+    for name in default_config:
+        if name.endswith('_COLLECTION'):
+            default_config[name] = connection.collection(name[:-len('_COLLECTION')].lower())
+    default_config['DEBUG'] = False
+    return default_config
+
+
+def connect(database_name):
+    """
+    Returns a Connection to database_name on the MONGODB_URI server and
+    the config using it.
+    """
+    connection = database.Connection(os.environ.get('MONGODB_URI', 'mongodb://localhost'),
+                                     database_name, **database.client_options())
+    return connection, make_config(connection)
+
+
+def drop(connection):
+    connection.get_client().drop_database(connection.database_name)
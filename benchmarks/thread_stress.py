@@ -0,0 +1,172 @@
+"""
+Concurrency check of the Post, User and Settings data access classes.
+
+Run from the project root against a MongoDB server:
+
+    python -m benchmarks.thread_stress [--threads 32] [--calls 2000]
+
+A single Post, User and Settings instance, as web.py creates them, is
+shared by --threads threads making --calls lookups whose answers are
+known up front. Each result is checked against the arguments of its own
+call, so a result leaking between concurrent calls is counted as a
+mismatch. Settings writes race get_config, which must never return a
+mix of two saved settings. The scratch --database is dropped afterwards.
+Exits non zero on mismatches.
+"""
+import argparse
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import post
+import settings
+import user
+from benchmarks import scratch
+
+
+def make_post(index):
+    return {'incident_title': 'Stress incident %d' % index,
+            'incident_description': 'Description of stress incident %d' % index,
+            'ttp_resource_infrastructure': 'Ethereum',
+            'incident_categories': 'Smart Contract',
+            'ttp_description': 'Reentrancy',
+            'ttp_exploits_targets': 'Wallet',
+            'incident_time_initial_compromise': '01/01/2018',
+            'incident_time_incident_reported': '02/01/2018',
+            'loss_crypto': '%d ETH' % index,
+            'loss_usd': '$%d' % (index * 1000),
+            'description_geographical': 'Singapore',
+            'references': 'https://localhost/%d' % index,
+            'advanced': None,
+            'author': 'stress_0'}
+
+
+def populate(post_class, user_class, count):
+    """
+    Creates count users and posts, returns the permalinks of the posts.
+    """
+    permalinks = []
+    for index in range(count):
+        password = 'password-%d' % index
+        response = user_class.save_user({
+            '_id': 'stress_%d' % index, 'email': 'stress%d@localhost.com' % index,
+            'new_pass': password, 'new_pass_again': password,
+            'super': index % 2 == 0, 'update': False})
+        if response['error']:
+            raise RuntimeError(response['error'])
+
+        post_data = post_class.validate_post_data(make_post(index))
+        post_data['tags'] = ['stress-%d' % index]
+        response = post_class.create_new_post(post_data)
+        if response['error']:
+            raise RuntimeError(response['error'])
+        permalinks.append(post_data['permalink'])
+    return permalinks
+
+
+def make_settings(index):
+    return {'title': 'Settings %d' % index, 'description': 'Description %d' % index,
+            'per_page': index + 1}
+
+
+def make_checks(post_class, user_class, settings_class, permalinks):
+    """
+    Returns the calls to make, each takes an index and returns whether
+    the result matches that index.
+    """
+    def login(index):
+        data = user_class.login('stress_%d' % index, 'password-%d' % index)['data']
+        return data['username'] == 'stress_%d' % index and \
+            data['super'] == (index % 2 == 0)
+
+    def failed_login(index):
+        response = user_class.login('stress_%d' % index, 'wrong')
+        return response['error'] is not None and response['data']['username'] is None
+
+    def get_user(index):
+        data = user_class.get_user('stress_%d' % index)['data']
+        return data['email'] == 'stress%d@localhost.com' % index
+
+    def get_post(index):
+        data = post_class.get_post_by_permalink(permalinks[index])['data']
+        return data['incident_title'] == 'Stress incident %d' % index
+
+    def get_posts(index):
+        response = post_class.get_posts(10, 0, tag='stress-%d' % index, shape='link')
+        return [row['incident_title'] for row in response['data']] == \
+            ['Stress incident %d' % index]
+
+    def update_settings(index):
+        return settings_class.update_settings(make_settings(index))['data'] is True
+
+    def get_config(index):
+        # Copied at once, the values of one saved settings document or of
+        # another but never a mix
+        config = dict(settings_class.get_config())
+        saved = config['PER_PAGE'] - 1
+        return (config['BLOG_TITLE'], config['BLOG_DESCRIPTION']) == \
+            (make_settings(saved)['title'], make_settings(saved)['description'])
+
+    return [login, failed_login, get_user, get_post, get_posts,
+            update_settings, get_config]
+
+
+def run(post_class, user_class, settings_class, permalinks, threads, calls, seed=0):
+    checks = make_checks(post_class, user_class, settings_class, permalinks)
+    rng = random.Random(seed)
+    work = [(rng.choice(checks), rng.randrange(len(permalinks))) for _ in range(calls)]
+
+    def call(item):
+        check, index = item
+        try:
+            return check.__name__, check(index)
+        except Exception:
+            return check.__name__, False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        outcomes = list(executor.map(call, work))
+    elapsed = time.perf_counter() - start
+
+    mismatches = {}
+    for name, ok in outcomes:
+        mismatches.setdefault(name, 0)
+        if not ok:
+            mismatches[name] += 1
+    return {'threads': threads, 'calls': calls, 'seconds': round(elapsed, 3),
+            'mismatches': mismatches}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--records', type=int, default=50,
+                        help='users and posts to create')
+    parser.add_argument('--database', default='incidentdb_stress',
+                        help='scratch database, dropped afterwards')
+    args = parser.parse_args(argv)
+
+    connection, default_config = scratch.connect(args.database)
+    scratch.drop(connection)
+    try:
+        post_class = post.Post(default_config)
+        user_class = user.User(default_config)
+        settings_class = settings.Settings(default_config)
+        default_config['SETTINGS_COLLECTION'].insert_one(dict(make_settings(0), text_search=0))
+        permalinks = populate(post_class, user_class, args.records)
+        results = run(post_class, user_class, settings_class, permalinks,
+                      args.threads, args.calls)
+    finally:
+        scratch.drop(connection)
+
+    print('%d calls on %d threads in %.3fs' % (
+        results['calls'], results['threads'], results['seconds']))
+    for name, count in sorted(results['mismatches'].items()):
+        print('%-15s %d mismatches' % (name, count))
+    return 1 if any(results['mismatches'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import collections
+import threading
+import time
+import database
+import metrics
+
+
+class WriteCache(object):
+    """
+    Process local cache for values derived from the incidents collection.
+
+    Entries are dropped explicitly by the write paths through invalidate().
+    The TTL bounds how long other workers, which don't see those
+    invalidations, can serve a stale value.
+
+    Keys can come from URLs (search strings, filters), so at most
+    max_entries are kept: expired entries are dropped first, then the
+    least recently used ones.
+
+    When generation is set to a page_cache.ContentGeneration, entries also
+    remember the generation they were built under and stop matching once
+    another worker bumps it, so pages of the new generation are never
+    rendered from values of the old one.
+    """
+
+    def __init__(self, ttl=60, name='write', max_entries=1000, generation=None):
+        self.ttl = ttl
+        self.name = name
+        self.max_entries = max_entries
+        self.generation = generation
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Returns the cached value for key, calling build() on a miss.
+
+        build() returns a (value, cacheable) tuple so failed lookups are
+        served once but not stored.
+        """
+        # Read before build(), a bump during the build leaves the entry
+        # under the older generation
+        generation = self.current_generation()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time() and entry[1] == generation:
+                    self.entries.move_to_end(key)
+                    metrics.cache_lookup(self.name, True)
+                    return entry[2]
+                del self.entries[key]
+        metrics.cache_lookup(self.name, False)
+
+        # Values are kept until the next write, so they are read from the
+        # primary even on routes that use secondaries
+        with database.reading_from(None):
+            value, cacheable = build()
+        if cacheable:
+            self.set(key, value, generation)
+        return value
+
+    def current_generation(self):
+        return self.generation.get() if self.generation is not None else None
+
+    def set(self, key, value, generation=None):
+        now = time.time()
+        current = self.current_generation()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, generation, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                for old_key in [old_key for old_key, entry in self.entries.items()
+                                if entry[0] <= now or entry[1] != current]:
+                    del self.entries[old_key]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
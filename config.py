@@ -1,19 +1,31 @@
-import pymongo
 import os
+import database
 
-# Settings for local dev
-CONNECTION = pymongo.MongoClient("mongodb://localhost")
-# Settings for Docker
-#CONNECTION = pymongo.MongoClient(host = os.environ['FLASKBLOG_DB_1_PORT_27017_TCP_ADDR'],
-#                                 port = 27017,
-#                                 username = "admin",
-#                                 password = "tochange")
+# The client is created lazily in each worker process. Settings come from
+# the environment, for local dev the defaults connect to localhost:
+#   MONGODB_URI       e.g. mongodb://admin:tochange@db:27017 for Docker
+#   MONGODB_DATABASE  defaults to blog
+#   MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE, MONGODB_MAX_IDLE_TIME_MS,
+#   MONGODB_WAIT_QUEUE_TIMEOUT_MS, MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+#   MONGODB_CONNECT_TIMEOUT_MS, MONGODB_SOCKET_TIMEOUT_MS,
+#   MONGODB_COMPRESSORS (e.g. zlib), MONGODB_APPNAME
+CONNECTION = database.Connection.from_environ("mongodb://localhost", "blog")
 
 '''Leave this as is if you dont have other configuration'''
-DATABASE = CONNECTION.blog
-POSTS_COLLECTION = DATABASE.posts
-USERS_COLLECTION = DATABASE.users
-SETTINGS_COLLECTION = DATABASE.settings
+POSTS_COLLECTION = CONNECTION.collection('posts')
+USERS_COLLECTION = CONNECTION.collection('users')
+SETTINGS_COLLECTION = CONNECTION.collection('settings')
+SEARCH_COLLECTION = CONNECTION.collection('search_index')
+STIX_COLLECTION = CONNECTION.collection('stix_cache')
+ANALYTICS_COLLECTION = CONNECTION.collection('analytics')
+MIGRATIONS_COLLECTION = CONNECTION.collection('migrations')
+COUNTERS_COLLECTION = CONNECTION.collection('counters')
+
+# Read preference of the read-only public routes, e.g. secondaryPreferred
+# to spread them over the replica set members. Writes always go to the
+# primary, and so do the reads of pages, feeds, counts and settings that
+# end up in a cache, as the cache keeps them until the next write.
+READ_PREFERENCE = os.environ.get('MONGODB_READ_PREFERENCE', 'primary')
 
 SECRET_KEY = ""
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -38,5 +50,57 @@ else:
 
 LOG_FILE = "app.log"
 
+# Seconds the blog settings are cached in each worker before re-reading them,
+# a write in another worker is seen after PAGE_CACHE_GENERATION_TTL at most
+SETTINGS_CACHE_TTL = 60
+
+# Seconds cached sidebar data is kept, writes made by other workers drop it
+# after PAGE_CACHE_GENERATION_TTL at most
+POSTS_CACHE_TTL = 60
+
+# Most counts, facets and sidebar entries a worker keeps, least recently
+# used ones are dropped first
+POSTS_CACHE_ENTRIES = 1000
+
+# Tag and search counts stop here and display as "1000+", None counts all
+COUNT_CAP = 1000
+
+# Milliseconds a $regex search count (text search off) may scan before it
+# gives up and displays as "1000+", None for no limit
+SEARCH_COUNT_MS = 500
+
+# Incidents fetched per cursor batch and written per chunk when exporting
+EXPORT_BATCH_SIZE = 500
+
+# Bytes of rendered public pages each worker keeps for anonymous visitors,
+# 0 disables the in-process page cache
+PAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+# Directory of a page cache shared by the workers of a host, None for none
+PAGE_CACHE_DIR = None
+
+# Bytes of pages kept in PAGE_CACHE_DIR, further pages are not stored there
+# until the next write starts a new generation
+PAGE_CACHE_DIR_BYTES = 256 * 1024 * 1024
+
+# Seconds browsers and proxies may reuse a public page (Cache-Control)
+PAGE_CACHE_MAX_AGE = 30
+
+# Seconds a worker may serve cached pages, settings and sidebar data after a
+# write made by another one
+PAGE_CACHE_GENERATION_TTL = 1
+
+# Send a Server-Timing header with the MongoDB time of each request to the
+# METRICS_ALLOWED_ADDRS and to logged in administrators
+SERVER_TIMING = True
+
+# MongoDB operations slower than this many milliseconds (and failed ones)
+# are logged as JSON lines to SLOW_QUERY_LOG, None disables the log
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG = "slow_queries.log"
+
+# Addresses allowed to scrape the Prometheus metrics at /metrics
+METRICS_ALLOWED_ADDRS = ['127.0.0.1', '::1']
+
 DEBUG = True  # set it to False on production
 
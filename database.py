@@ -0,0 +1,144 @@
+import contextlib
+import os
+import threading
+import pymongo
+from pymongo.read_preferences import ReadPreference
+
+
+# MongoClient keyword -> (environment variable, type) of the settings that
+# can be tuned per deployment without editing code
+CLIENT_OPTIONS = {'maxPoolSize': ('MONGODB_MAX_POOL_SIZE', int),
+                  'minPoolSize': ('MONGODB_MIN_POOL_SIZE', int),
+                  'maxIdleTimeMS': ('MONGODB_MAX_IDLE_TIME_MS', int),
+                  'waitQueueTimeoutMS': ('MONGODB_WAIT_QUEUE_TIMEOUT_MS', int),
+                  'serverSelectionTimeoutMS': ('MONGODB_SERVER_SELECTION_TIMEOUT_MS', int),
+                  'connectTimeoutMS': ('MONGODB_CONNECT_TIMEOUT_MS', int),
+                  'socketTimeoutMS': ('MONGODB_SOCKET_TIMEOUT_MS', int),
+                  'compressors': ('MONGODB_COMPRESSORS', str),
+                  'appname': ('MONGODB_APPNAME', str)}
+
+READ_PREFERENCES = {'primary': ReadPreference.PRIMARY,
+                    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+                    'secondary': ReadPreference.SECONDARY,
+                    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+                    'nearest': ReadPreference.NEAREST}
+
+# Read preference of the current thread, see reading_from
+_local = threading.local()
+
+
+def client_options(environ=None):
+    """
+    Returns the MongoClient keyword arguments set in the environment.
+    """
+    environ = os.environ if environ is None else environ
+    options = {}
+    for option, (name, cast) in CLIENT_OPTIONS.items():
+        if environ.get(name):
+            options[option] = cast(environ[name])
+    return options
+
+
+def read_preference(name):
+    """
+    Returns the read preference called name, e.g. 'secondaryPreferred'.
+    """
+    if name not in READ_PREFERENCES:
+        raise ValueError('Unknown read preference %r' % name)
+    return READ_PREFERENCES[name]
+
+
+@contextlib.contextmanager
+def reading_from(preference):
+    """
+    Sends the reads made by the current thread inside the block with the
+    given read preference. Writes always go to the primary.
+    """
+    previous = getattr(_local, 'preference', None)
+    _local.preference = preference
+    try:
+        yield
+    finally:
+        _local.preference = previous
+
+
+def set_read_preference(preference):
+    """
+    Sets the read preference of the current thread until it is reset with
+    None, for request hooks that cannot wrap a block in reading_from.
+    """
+    _local.preference = preference
+
+
+class Connection:
+    """
+    Creates the MongoClient lazily, in the process that uses it.
+
+    A client must not be shared across fork: under a prefork server such
+    as gunicorn the master would otherwise hand its connection pool and
+    monitor threads to every worker. The client is created on first use
+    and again whenever the process id changes.
+    """
+
+    def __init__(self, uri, database, **options):
+        self.uri = uri
+        self.database_name = database
+        self.options = options
+        self.pid = None
+        self.client = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, uri='mongodb://localhost', database='blog', environ=None):
+        environ = os.environ if environ is None else environ
+        return cls(environ.get('MONGODB_URI', uri),
+                   environ.get('MONGODB_DATABASE', database),
+                   **client_options(environ))
+
+    def get_client(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.client = pymongo.MongoClient(self.uri, **self.options)
+                    self.pid = os.getpid()
+        return self.client
+
+    def get_database(self):
+        return self.get_client()[self.database_name]
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+
+class LazyCollection:
+    """
+    Stands in for a pymongo Collection of a Connection, resolving it on
+    every use so it always belongs to the current process' client and
+    honours the read preference of the current thread.
+    """
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.pid = None
+        self.collections = {}
+
+    def get_collection(self):
+        if self.pid != os.getpid():
+            self.collections = {}
+            self.pid = os.getpid()
+        preference = getattr(_local, 'preference', None)
+        mode = preference.name if preference is not None else None
+        collection = self.collections.get(mode)
+        if collection is None:
+            collection = self.connection.get_database()[self.name]
+            if preference is not None:
+                collection = collection.with_options(read_preference=preference)
+            self.collections[mode] = collection
+        return collection
+
+    def __getattr__(self, attribute):
+        return getattr(self.get_collection(), attribute)
+
+    def __repr__(self):
+        return 'LazyCollection(%r, %r)' % (self.connection.database_name, self.name)
@@ -0,0 +1,80 @@
+import csv
+import datetime
+import html
+import io
+import json
+from importer import COLUMNS
+
+
+class Exporter:
+    """
+    Streams the whole incident database as CSV or JSON lines.
+
+    Posts are read with a bounded cursor batch size and serialized into
+    chunks of rows, so memory use does not depend on the number of
+    incidents. The CSV layout is the one importer.CsvImporter reads, so
+    an export can be imported again as is.
+    """
+
+    # Extra fields of the JSON lines export
+    JSONL_FIELDS = ['permalink', 'date', 'author', 'tags', 'advanced']
+
+    def __init__(self, default_config):
+        self.collection = default_config['POSTS_COLLECTION']
+        self.batch_size = default_config.get('EXPORT_BATCH_SIZE', 500)
+
+    def iter_posts(self, fields):
+        return self.collection.find({}, dict.fromkeys(fields, 1)) \
+            .sort('_id', 1).batch_size(self.batch_size)
+
+    @staticmethod
+    def export_value(value):
+        """
+        Converts a stored value back to its plain text form, undoing the
+        HTML escaping done by Post.validate_post_data.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if isinstance(value, list):
+            return ','.join(value)
+        return html.unescape(str(value))
+
+    def iter_csv(self):
+        """
+        Yields the CSV export, header first, in chunks of batch_size rows.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        rows = 0
+        for post in self.iter_posts(COLUMNS):
+            writer.writerow([self.export_value(post.get(field)) for field in COLUMNS])
+            rows += 1
+            if rows >= self.batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                rows = 0
+        yield buffer.getvalue()
+
+    def iter_jsonl(self):
+        """
+        Yields one JSON object per incident and line, in chunks of
+        batch_size lines.
+        """
+        fields = COLUMNS + self.JSONL_FIELDS
+        lines = []
+        for post in self.iter_posts(fields):
+            record = {'id': str(post['_id'])}
+            for field in fields:
+                value = post.get(field)
+                record[field] = value if value is None or field == 'tags' \
+                    else self.export_value(value)
+            lines.append(json.dumps(record, sort_keys=True))
+            if len(lines) >= self.batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
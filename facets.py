@@ -0,0 +1,119 @@
+import datetime
+import geography
+
+
+# Facet name (query string argument) -> (post field, sidebar title)
+FACETS = [('category', 'incident_categories', 'Category'),
+          ('platform', 'ttp_resource_infrastructure', 'Platform'),
+          ('country', 'country_codes', 'Country')]
+
+# Date field the 'since'/'until' range and the year facet apply to
+DATE_FIELD = 'incident_time_initial_compromise'
+
+DATE_FORMATS = [('%Y-%m-%d', 'day'), ('%Y-%m', 'month'), ('%Y', 'year')]
+
+
+def parse_bound(value, end=False):
+    """
+    Parses a 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' range bound into the start
+    of that period, or with end into the start of the next one so the
+    whole period is included. Returns None when value is malformed.
+    """
+    for date_format, period in DATE_FORMATS:
+        try:
+            date = datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if not end:
+            return date
+        if period == 'day':
+            return date + datetime.timedelta(days=1)
+        if period == 'month':
+            return date.replace(year=date.year + date.month // 12,
+                                month=date.month % 12 + 1)
+        return date.replace(year=date.year + 1)
+    return None
+
+
+def parse_filters(args):
+    """
+    Reads the facet filters out of a query string mapping.
+
+    :return: (filters, error) tuple, filters a dictionary holding the
+        given facet values and 'since'/'until' datetimes, error True when
+        a date bound is malformed
+    """
+    filters = {}
+    for name, field, title in FACETS:
+        value = args.get(name)
+        if value:
+            filters[name] = value
+    for name in ('since', 'until'):
+        value = args.get(name)
+        if value:
+            bound = parse_bound(value, end=name == 'until')
+            if bound is None:
+                return {}, True
+            filters[name] = bound
+    return filters, False
+
+
+def make_condition(filters):
+    """
+    Returns the MongoDB condition selecting the posts matching filters.
+    """
+    cond = {}
+    for name, field, title in FACETS:
+        if filters.get(name):
+            cond[field] = filters[name]
+    if filters.get('since') or filters.get('until'):
+        cond[DATE_FIELD] = {}
+        if filters.get('since'):
+            cond[DATE_FIELD]['$gte'] = filters['since']
+        if filters.get('until'):
+            cond[DATE_FIELD]['$lt'] = filters['until']
+    return cond
+
+
+def cache_key(filters):
+    return tuple(sorted((filters or {}).items()))
+
+
+def make_pipeline(cond, limit):
+    """
+    Returns an aggregation pipeline computing the counts of every facet
+    value and year among the posts matching cond in a single $facet stage.
+    """
+    branches = {}
+    for name, field, title in FACETS:
+        branch = [{'$match': {field: {'$nin': [None, '']}}}]
+        if field == 'country_codes':
+            branch = [{'$unwind': '$' + field}]
+        branches[name] = branch + [
+            {'$group': {'_id': '$' + field, 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': limit}]
+    branches['year'] = [
+        {'$match': {DATE_FIELD: {'$type': 'date'}}},
+        {'$group': {'_id': {'$year': '$' + DATE_FIELD}, 'count': {'$sum': 1}}},
+        {'$sort': {'_id': -1}}]
+    return [{'$match': cond}, {'$facet': branches}]
+
+
+def make_facets(result):
+    """
+    Turns the $facet result document into a list of
+    {'name', 'title', 'values'} dictionaries for the sidebar, each value
+    a {'value', 'label', 'count'} dictionary.
+    """
+    facets = []
+    for name, field, title in FACETS + [('year', DATE_FIELD, 'Year')]:
+        values = []
+        for bucket in result.get(name, []):
+            label = str(bucket['_id'])
+            if name == 'country':
+                label = geography.country_name(bucket['_id'])
+            values.append({'value': str(bucket['_id']), 'label': label,
+                           'count': bucket['count']})
+        facets.append({'name': name, 'title': title, 'values': values})
+    return facets
@@ -0,0 +1,151 @@
+import html
+import re
+
+
+# ISO 3166-1 alpha-2 code -> English short name
+COUNTRIES = {
+    'AD': 'Andorra', 'AE': 'United Arab Emirates', 'AF': 'Afghanistan',
+    'AG': 'Antigua and Barbuda', 'AI': 'Anguilla', 'AL': 'Albania',
+    'AM': 'Armenia', 'AO': 'Angola', 'AQ': 'Antarctica', 'AR': 'Argentina',
+    'AS': 'American Samoa', 'AT': 'Austria', 'AU': 'Australia', 'AW': 'Aruba',
+    'AX': 'Aland Islands', 'AZ': 'Azerbaijan',
+    'BA': 'Bosnia and Herzegovina', 'BB': 'Barbados', 'BD': 'Bangladesh',
+    'BE': 'Belgium', 'BF': 'Burkina Faso', 'BG': 'Bulgaria', 'BH': 'Bahrain',
+    'BI': 'Burundi', 'BJ': 'Benin', 'BL': 'Saint Barthelemy', 'BM': 'Bermuda',
+    'BN': 'Brunei', 'BO': 'Bolivia', 'BQ': 'Caribbean Netherlands',
+    'BR': 'Brazil', 'BS': 'Bahamas', 'BT': 'Bhutan', 'BV': 'Bouvet Island',
+    'BW': 'Botswana', 'BY': 'Belarus', 'BZ': 'Belize',
+    'CA': 'Canada', 'CC': 'Cocos Islands', 'CD': 'DR Congo',
+    'CF': 'Central African Republic', 'CG': 'Republic of the Congo',
+    'CH': 'Switzerland', 'CI': "Cote d'Ivoire", 'CK': 'Cook Islands',
+    'CL': 'Chile', 'CM': 'Cameroon', 'CN': 'China', 'CO': 'Colombia',
+    'CR': 'Costa Rica', 'CU': 'Cuba', 'CV': 'Cape Verde', 'CW': 'Curacao',
+    'CX': 'Christmas Island', 'CY': 'Cyprus', 'CZ': 'Czechia',
+    'DE': 'Germany', 'DJ': 'Djibouti', 'DK': 'Denmark', 'DM': 'Dominica',
+    'DO': 'Dominican Republic', 'DZ': 'Algeria',
+    'EC': 'Ecuador', 'EE': 'Estonia', 'EG': 'Egypt', 'EH': 'Western Sahara',
+    'ER': 'Eritrea', 'ES': 'Spain', 'ET': 'Ethiopia',
+    'FI': 'Finland', 'FJ': 'Fiji', 'FK': 'Falkland Islands',
+    'FM': 'Micronesia', 'FO': 'Faroe Islands', 'FR': 'France',
+    'GA': 'Gabon', 'GB': 'United Kingdom', 'GD': 'Grenada', 'GE': 'Georgia',
+    'GF': 'French Guiana', 'GG': 'Guernsey', 'GH': 'Ghana', 'GI': 'Gibraltar',
+    'GL': 'Greenland', 'GM': 'Gambia', 'GN': 'Guinea', 'GP': 'Guadeloupe',
+    'GQ': 'Equatorial Guinea', 'GR': 'Greece',
+    'GS': 'South Georgia and the South Sandwich Islands', 'GT': 'Guatemala',
+    'GU': 'Guam', 'GW': 'Guinea-Bissau', 'GY': 'Guyana',
+    'HK': 'Hong Kong', 'HM': 'Heard Island and McDonald Islands',
+    'HN': 'Honduras', 'HR': 'Croatia', 'HT': 'Haiti', 'HU': 'Hungary',
+    'ID': 'Indonesia', 'IE': 'Ireland', 'IL': 'Israel', 'IM': 'Isle of Man',
+    'IN': 'India', 'IO': 'British Indian Ocean Territory', 'IQ': 'Iraq',
+    'IR': 'Iran', 'IS': 'Iceland', 'IT': 'Italy',
+    'JE': 'Jersey', 'JM': 'Jamaica', 'JO': 'Jordan', 'JP': 'Japan',
+    'KE': 'Kenya', 'KG': 'Kyrgyzstan', 'KH': 'Cambodia', 'KI': 'Kiribati',
+    'KM': 'Comoros', 'KN': 'Saint Kitts and Nevis', 'KP': 'North Korea',
+    'KR': 'South Korea', 'KW': 'Kuwait', 'KY': 'Cayman Islands',
+    'KZ': 'Kazakhstan',
+    'LA': 'Laos', 'LB': 'Lebanon', 'LC': 'Saint Lucia', 'LI': 'Liechtenstein',
+    'LK': 'Sri Lanka', 'LR': 'Liberia', 'LS': 'Lesotho', 'LT': 'Lithuania',
+    'LU': 'Luxembourg', 'LV': 'Latvia', 'LY': 'Libya',
+    'MA': 'Morocco', 'MC': 'Monaco', 'MD': 'Moldova', 'ME': 'Montenegro',
+    'MF': 'Saint Martin', 'MG': 'Madagascar', 'MH': 'Marshall Islands',
+    'MK': 'North Macedonia', 'ML': 'Mali', 'MM': 'Myanmar', 'MN': 'Mongolia',
+    'MO': 'Macau', 'MP': 'Northern Mariana Islands', 'MQ': 'Martinique',
+    'MR': 'Mauritania', 'MS': 'Montserrat', 'MT': 'Malta', 'MU': 'Mauritius',
+    'MV': 'Maldives', 'MW': 'Malawi', 'MX': 'Mexico', 'MY': 'Malaysia',
+    'MZ': 'Mozambique',
+    'NA': 'Namibia', 'NC': 'New Caledonia', 'NE': 'Niger',
+    'NF': 'Norfolk Island', 'NG': 'Nigeria', 'NI': 'Nicaragua',
+    'NL': 'Netherlands', 'NO': 'Norway', 'NP': 'Nepal', 'NR': 'Nauru',
+    'NU': 'Niue', 'NZ': 'New Zealand',
+    'OM': 'Oman',
+    'PA': 'Panama', 'PE': 'Peru', 'PF': 'French Polynesia',
+    'PG': 'Papua New Guinea', 'PH': 'Philippines', 'PK': 'Pakistan',
+    'PL': 'Poland', 'PM': 'Saint Pierre and Miquelon', 'PN': 'Pitcairn Islands',
+    'PR': 'Puerto Rico', 'PS': 'Palestine', 'PT': 'Portugal', 'PW': 'Palau',
+    'PY': 'Paraguay',
+    'QA': 'Qatar',
+    'RE': 'Reunion', 'RO': 'Romania', 'RS': 'Serbia', 'RU': 'Russia',
+    'RW': 'Rwanda',
+    'SA': 'Saudi Arabia', 'SB': 'Solomon Islands', 'SC': 'Seychelles',
+    'SD': 'Sudan', 'SE': 'Sweden', 'SG': 'Singapore', 'SH': 'Saint Helena',
+    'SI': 'Slovenia', 'SJ': 'Svalbard and Jan Mayen', 'SK': 'Slovakia',
+    'SL': 'Sierra Leone', 'SM': 'San Marino', 'SN': 'Senegal',
+    'SO': 'Somalia', 'SR': 'Suriname', 'SS': 'South Sudan',
+    'ST': 'Sao Tome and Principe', 'SV': 'El Salvador', 'SX': 'Sint Maarten',
+    'SY': 'Syria', 'SZ': 'Eswatini',
+    'TC': 'Turks and Caicos Islands', 'TD': 'Chad',
+    'TF': 'French Southern Territories', 'TG': 'Togo', 'TH': 'Thailand',
+    'TJ': 'Tajikistan', 'TK': 'Tokelau', 'TL': 'Timor-Leste',
+    'TM': 'Turkmenistan', 'TN': 'Tunisia', 'TO': 'Tonga', 'TR': 'Turkey',
+    'TT': 'Trinidad and Tobago', 'TV': 'Tuvalu', 'TW': 'Taiwan',
+    'TZ': 'Tanzania',
+    'UA': 'Ukraine', 'UG': 'Uganda', 'UM': 'United States Minor Outlying Islands',
+    'US': 'United States', 'UY': 'Uruguay', 'UZ': 'Uzbekistan',
+    'VA': 'Vatican City', 'VC': 'Saint Vincent and the Grenadines',
+    'VE': 'Venezuela', 'VG': 'British Virgin Islands',
+    'VI': 'United States Virgin Islands', 'VN': 'Vietnam', 'VU': 'Vanuatu',
+    'WF': 'Wallis and Futuna', 'WS': 'Samoa',
+    'YE': 'Yemen', 'YT': 'Mayotte',
+    'ZA': 'South Africa', 'ZM': 'Zambia', 'ZW': 'Zimbabwe',
+}
+
+# Other spellings found in incident reports, lower case -> code
+ALIASES = {
+    'usa': 'US', 'u.s.': 'US', 'u.s.a.': 'US', 'america': 'US',
+    'united states of america': 'US',
+    'uk': 'GB', 'u.k.': 'GB', 'great britain': 'GB', 'britain': 'GB',
+    'england': 'GB', 'scotland': 'GB', 'wales': 'GB',
+    'korea': 'KR', 'republic of korea': 'KR', 's. korea': 'KR',
+    'dprk': 'KP', 'n. korea': 'KP',
+    'russian federation': 'RU', 'czech republic': 'CZ', 'holland': 'NL',
+    'the netherlands': 'NL', 'uae': 'AE', 'dubai': 'AE',
+    'hongkong': 'HK', 'macao': 'MO', 'viet nam': 'VN', 'burma': 'MM',
+    'prc': 'CN', 'mainland china': 'CN', 'republic of china': 'TW',
+    'ivory coast': 'CI', 'swaziland': 'SZ', 'macedonia': 'MK',
+    'east timor': 'TL', 'the bahamas': 'BS', 'the gambia': 'GM',
+    'vatican': 'VA', 'congo': 'CG', 'drc': 'CD',
+    'democratic republic of the congo': 'CD', 'brunei darussalam': 'BN',
+    'lao': 'LA', 'syrian arab republic': 'SY', 'turkiye': 'TR',
+}
+
+NAMES = dict((name.lower(), code) for code, name in COUNTRIES.items())
+NAMES.update(ALIASES)
+
+# Separators between several places in one description_geographical value
+SEPARATORS_RE = re.compile(r'\s*(?:[,;/|&+()]|\band\b|\n)\s*', re.IGNORECASE)
+
+
+def lookup(name):
+    """
+    Returns the country code of a single place name or code, None when it
+    is not a known country.
+    """
+    name = name.strip().strip('.').strip()
+    if name in COUNTRIES:
+        return name
+    return NAMES.get(name.lower()) or NAMES.get(name.lower() + '.')
+
+
+def country_codes(value):
+    """
+    Normalizes a free text description_geographical value such as
+    "Singapore", "USA, South Korea" or "JP" into a list of ISO 3166-1
+    alpha-2 codes, in the order they appear. Unknown places are left out.
+    """
+    if not value:
+        return []
+    value = html.unescape(value)
+    code = lookup(value)
+    if code:
+        return [code]
+
+    codes = []
+    for part in SEPARATORS_RE.split(value):
+        code = lookup(part) if part else None
+        if code and code not in codes:
+            codes.append(code)
+    return codes
+
+
+def country_name(code):
+    return COUNTRIES.get(code, code)
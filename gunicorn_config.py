@@ -0,0 +1,27 @@
+# gunicorn settings, used with `gunicorn -c gunicorn_config.py web:app`
+import os
+import shutil
+import tempfile
+
+# Workers write their Prometheus samples to this directory so /metrics
+# reports the totals of all of them. It must be set before the workers
+# import prometheus_client, which is why it lives here and not in config.py
+os.environ.setdefault('prometheus_multiproc_dir',
+                      os.path.join(tempfile.gettempdir(), 'incidentdb-metrics'))
+
+# Post, User and Settings keep no per-request state, so a few processes
+# with many threads each serve as much as many single threaded ones
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    # Samples left by the workers of a previous run would be added up too
+    directory = os.environ['prometheus_multiproc_dir']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
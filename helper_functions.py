@@ -2,16 +2,89 @@ import re
 import string
 import random
 from urllib.parse import urljoin
-from flask import request, url_for, session, flash, redirect
+from flask import request, url_for, session, flash, redirect, abort
 from functools import wraps
+import pagination
+import facets
+
+
+def listing_args():
+    """
+    Returns the arguments of the current listing URL without its page
+    position, keeping query string filters.
+    """
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(request.view_args)
+    args.pop('page', None)
+    return args
 
 
 def url_for_other_page(page):
-    args = request.view_args.copy()
+    args = listing_args()
     args['page'] = page
     return url_for(request.endpoint, **args)
 
 
+def url_for_cursor(after=None, before=None):
+    args = listing_args()
+    if after is not None:
+        args['after'] = after
+    if before is not None:
+        args['before'] = before
+    return url_for(request.endpoint, **args)
+
+
+def get_page_cursor():
+    """
+    Returns the decoded (after, before) keyset positions of the request,
+    aborting with 400 on a malformed token.
+    """
+    positions = []
+    for name in ('after', 'before'):
+        token = request.args.get(name)
+        position = None
+        if token:
+            position = pagination.decode_cursor(token)
+            if position is None:
+                abort(400)
+        positions.append(position)
+    return tuple(positions)
+
+
+def get_facet_filters():
+    """
+    Returns the facet filters of the request, aborting with 400 on a
+    malformed date bound.
+    """
+    filters, error = facets.parse_filters(request.args)
+    if error:
+        abort(400)
+    return filters
+
+
+def url_for_facet(name, value=None):
+    """
+    Returns the /browse URL of the current filters with facet name set to
+    value, or removed when value is None. A 'year' value sets the
+    since/until range.
+    """
+    args = request.args.to_dict() if request.endpoint == 'browse' else {}
+    for arg in ('after', 'before', 'page'):
+        args.pop(arg, None)
+    if name == 'year':
+        args.pop('since', None)
+        args.pop('until', None)
+        if value is not None:
+            args['since'] = args['until'] = value
+    elif value is None:
+        args.pop(name, None)
+    else:
+        args[name] = value
+    return url_for('browse', **args)
+
+
 def extract_tags(tags):
     whitespace = re.compile('\s')
     nowhite = whitespace.sub("", tags)
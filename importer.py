@@ -0,0 +1,91 @@
+import codecs
+import csv
+
+
+# Column layout of the incident CSV files, after a header row
+COLUMNS = ['incident_title',
+           'incident_time_initial_compromise',
+           'incident_time_incident_reported',
+           'incident_description',
+           'ttp_resource_infrastructure',
+           'incident_categories',
+           'ttp_description',
+           'ttp_exploits_targets',
+           'loss_crypto',
+           'loss_usd',
+           'description_geographical',
+           'references']
+
+
+class CsvImporter:
+    """
+    Streams incidents from a CSV file into the posts collection.
+
+    The file is decoded and parsed line by line, rows are validated and
+    written in batches of batch_size with unordered insert_many, so the
+    upload is never held in memory as a whole.
+    """
+
+    def __init__(self, post_class, batch_size=500):
+        self.post_class = post_class
+        self.batch_size = batch_size
+
+    def run(self, stream, author):
+        """
+        Imports every row of the binary stream as a post by author.
+
+        :return: report dictionary with the following keys:
+            'imported' number of inserted posts
+            'errors' list of {'row': line number, 'error': message}
+        """
+        report = {'imported': 0, 'errors': []}
+        reader = csv.reader(codecs.getreader('utf-8-sig')(stream, errors='replace'),
+                            delimiter=',')
+
+        # skip header
+        next(reader, None)
+
+        batch = []
+        for row in reader:
+            if not any(row):
+                continue
+            post_data, error = self.validate_row(row, author)
+            if error:
+                report['errors'].append({'row': reader.line_num, 'error': error})
+            else:
+                batch.append((reader.line_num, post_data))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch, report)
+                batch = []
+        if batch:
+            self.write_batch(batch, report)
+
+        report['errors'].sort(key=lambda error: error['row'])
+        return report
+
+    def validate_row(self, row, author):
+        if len(row) < len(COLUMNS):
+            return None, 'Expected %d columns, got %d..' % (len(COLUMNS), len(row))
+
+        post_data = dict(zip(COLUMNS, (value.strip() for value in row)))
+        if not post_data['incident_title'] or not post_data['incident_description']:
+            return None, 'Title and description are required..'
+
+        post_data['advanced'] = None
+        post_data['author'] = author
+        try:
+            return self.post_class.validate_post_data(post_data), None
+        except Exception as e:
+            return None, str(e)
+
+    def write_batch(self, batch, report):
+        response = self.post_class.create_new_posts(
+            [post_data for line_num, post_data in batch])
+        if response['error']:
+            for line_num, post_data in batch:
+                report['errors'].append({'row': line_num, 'error': response['error']})
+            return
+
+        for index, error in sorted(response['failed'].items()):
+            report['errors'].append({'row': batch[index][0], 'error': error})
+        report['imported'] += len(response['data'])
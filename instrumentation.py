@@ -0,0 +1,197 @@
+import datetime
+import json
+import logging
+import threading
+import time
+from pymongo import monitoring
+
+
+# Command argument holding the filter of each command
+FILTER_ARGUMENTS = {'find': 'filter', 'count': 'query', 'distinct': 'query',
+                    'findAndModify': 'query', 'findandmodify': 'query'}
+
+# Statement list and filter key of bulk write commands
+STATEMENT_ARGUMENTS = {'update': ('updates', 'q'), 'delete': ('deletes', 'q')}
+
+slow_log = logging.getLogger('incidentdb.slow_queries')
+
+_local = threading.local()
+
+
+def shape(value):
+    """
+    Replaces the values in a filter with '?', keeping field names and
+    operators, so queries that only differ in their values look the same.
+    """
+    if isinstance(value, dict):
+        return dict((key, shape(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)) and any(isinstance(item, dict) for item in value):
+        return [shape(item) for item in value]
+    return '?'
+
+
+def command_collection(command_name, command):
+    if command_name == 'getMore':
+        return command.get('collection')
+    collection = command.get(command_name)
+    return collection if isinstance(collection, str) else None
+
+
+def command_shape(command_name, command):
+    """
+    Returns the shape of the filter (and sort) of a command, None for
+    commands without one.
+    """
+    if command_name in FILTER_ARGUMENTS:
+        result = {'filter': shape(command.get(FILTER_ARGUMENTS[command_name]) or {})}
+        if command.get('sort'):
+            result['sort'] = dict(command['sort'])
+        return result
+    if command_name in STATEMENT_ARGUMENTS:
+        statements, key = STATEMENT_ARGUMENTS[command_name]
+        statements = command.get(statements) or [{}]
+        return {'filter': shape(statements[0].get(key) or {}),
+                'statements': len(statements)}
+    if command_name == 'aggregate':
+        return {'pipeline': [shape(stage) if '$match' in stage else list(stage)[0]
+                             for stage in command.get('pipeline', [])]}
+    return None
+
+
+def reply_documents(command_name, reply):
+    """
+    Returns the number of documents a command returned or wrote.
+    """
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    if command_name.lower() == 'findandmodify':
+        return 1 if reply.get('value') else 0
+    if 'n' in reply:
+        return reply['n']
+    if 'values' in reply:
+        return len(reply['values'])
+    return 0
+
+
+class Recorder:
+    """
+    The MongoDB operations made by one request.
+    """
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.operations = []
+        self.started = time.time()
+
+    @property
+    def elapsed_ms(self):
+        return (time.time() - self.started) * 1000
+
+    @property
+    def total_ms(self):
+        return sum(operation['duration_ms'] for operation in self.operations)
+
+    def server_timing(self, max_operations=5):
+        """
+        Returns a Server-Timing header value with the total database time,
+        the slowest operations and the time of the whole request.
+        """
+        metrics = ['db;dur=%.1f;desc="%d queries"' % (self.total_ms, len(self.operations))]
+        slowest = sorted(self.operations, key=lambda operation: -operation['duration_ms'])
+        for index, operation in enumerate(slowest[:max_operations]):
+            metrics.append('db%d;dur=%.1f;desc="%s %s"' % (
+                index + 1, operation['duration_ms'], operation['command'],
+                operation['collection'] or ''))
+        metrics.append('app;dur=%.1f' % self.elapsed_ms)
+        return ', '.join(metrics)
+
+
+def start_request(**context):
+    """
+    Starts recording the operations of the current thread.
+    """
+    _local.recorder = Recorder(context)
+    return _local.recorder
+
+
+def end_request():
+    """
+    Stops recording and returns the Recorder of the current thread.
+    """
+    recorder = getattr(_local, 'recorder', None)
+    _local.recorder = None
+    return recorder
+
+
+class QueryListener(monitoring.CommandListener):
+    """
+    Times every MongoDB command, adds it to the Recorder of the thread
+    that ran it and logs the ones slower than slow_ms as JSON lines.
+    Every operation is also passed to the callables in observers.
+    """
+
+    def __init__(self, slow_ms=None):
+        self.slow_ms = slow_ms
+        self.observers = []
+
+    @staticmethod
+    def pending():
+        if not hasattr(_local, 'pending'):
+            _local.pending = {}
+        return _local.pending
+
+    def started(self, event):
+        self.pending()[(event.request_id, event.connection_id)] = (
+            command_collection(event.command_name, event.command),
+            command_shape(event.command_name, event.command))
+
+    def succeeded(self, event):
+        self.finished(event, reply_documents(event.command_name, event.reply), None)
+
+    def failed(self, event):
+        self.finished(event, 0, str(event.failure.get('errmsg', event.failure)))
+
+    def finished(self, event, documents, error):
+        collection, operation_shape = self.pending().pop(
+            (event.request_id, event.connection_id), (None, None))
+        operation = {'command': event.command_name,
+                     'collection': collection,
+                     'shape': operation_shape,
+                     'duration_ms': event.duration_micros / 1000.0,
+                     'documents': documents}
+        if error:
+            operation['error'] = error
+
+        for observer in self.observers:
+            observer(operation)
+        recorder = getattr(_local, 'recorder', None)
+        if recorder is not None:
+            recorder.operations.append(operation)
+        if error or (self.slow_ms is not None and operation['duration_ms'] >= self.slow_ms):
+            record = dict(operation, time=datetime.datetime.utcnow().isoformat() + 'Z')
+            if recorder is not None:
+                record.update(recorder.context)
+            slow_log.warning(json.dumps(record, sort_keys=True, default=str))
+
+
+_listener = None
+
+
+def install(default_config):
+    """
+    Registers the query listener for the MongoDB clients created from now
+    on, once per process, and sets up the slow query log file.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    _listener = QueryListener(default_config.get('SLOW_QUERY_MS'))
+    monitoring.register(_listener)
+
+    if default_config.get('SLOW_QUERY_LOG'):
+        handler = logging.FileHandler(default_config['SLOW_QUERY_LOG'])
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_log.addHandler(handler)
+        slow_log.propagate = False
+    return _listener
@@ -0,0 +1,63 @@
+import html
+import re
+
+
+# Typed fields stored next to the free text loss_usd/loss_crypto values
+FIELDS = ['loss_usd_amount', 'loss_crypto_amount', 'loss_crypto_asset']
+
+MULTIPLIERS = {'k': 1e3, 'thousand': 1e3,
+               'm': 1e6, 'mm': 1e6, 'mil': 1e6, 'million': 1e6, 'millions': 1e6,
+               'b': 1e9, 'bn': 1e9, 'billion': 1e9, 'billions': 1e9}
+
+CURRENCY_SIGNS = {'$': 'USD', '€': 'EUR', '£': 'GBP', '¥': 'JPY'}
+
+# An optional currency sign or upper case symbol before the amount, the
+# amount, then an optional multiplier and/or symbol after it, e.g. "$1.2m",
+# "100 BTC", "ETH 3,600,000" or "1.5 million USD"
+LOSS_RE = re.compile(
+    r'(?:(?P<sign>[$€£¥])\s*|\b(?P<before>[A-Z]{2,6})\s+)?'
+    r'(?P<amount>\d+(?:,\d{3})*(?:\.\d+)?|\.\d+)'
+    r'(?:\s*(?P<word>[A-Za-z]+)\b(?:\s*(?P<after>[A-Za-z]{2,6})\b)?)?')
+
+
+def parse_loss(value):
+    """
+    Extracts the first amount and its asset symbol from a free text loss
+    such as "100 BTC", "$1,200,000" or "1.5 million USD".
+
+    :return: (amount, asset) tuple, amount a float and asset an upper case
+        symbol, either of which is None when it cannot be found
+    """
+    if not value:
+        return None, None
+    match = LOSS_RE.search(html.unescape(value))
+    if not match:
+        return None, None
+
+    amount = float(match.group('amount').replace(',', ''))
+    asset = None
+    if match.group('sign'):
+        asset = CURRENCY_SIGNS[match.group('sign')]
+    elif match.group('before'):
+        asset = match.group('before')
+
+    word = match.group('word')
+    if word and word.lower() in MULTIPLIERS:
+        amount *= MULTIPLIERS[word.lower()]
+        word = match.group('after')
+    if word and len(word) <= 6 and word.lower() not in MULTIPLIERS:
+        # a symbol after the amount wins over one before it, "USD 100 BTC"
+        asset = word.upper()
+    return amount, asset
+
+
+def normalize(post_data):
+    """
+    Sets the typed loss fields of post_data from its free text loss_usd
+    and loss_crypto values. Returns post_data.
+    """
+    post_data['loss_usd_amount'] = parse_loss(post_data.get('loss_usd'))[0]
+    amount, asset = parse_loss(post_data.get('loss_crypto'))
+    post_data['loss_crypto_amount'] = amount
+    post_data['loss_crypto_asset'] = asset if amount is not None else None
+    return post_data
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import markdown
+from markupsafe import Markup
+from mdx_github_gists import GitHubGistExtension
+from mdx_strike import StrikeExtension
+from mdx_quote import QuoteExtension
+from mdx_code_multiline import MultilineCodeExtension
+import metrics
+
+
+# Extensions every incident body is rendered with
+EXTENSIONS = [GitHubGistExtension, StrikeExtension, QuoteExtension,
+              MultilineCodeExtension]
+
+# Bump when an extension changes its output without changing its name
+RENDER_REVISION = 1
+
+# Stored HTML rendered with another version is stale and re-rendered
+RENDER_VERSION = hashlib.sha1(('%s:%s:%s' % (
+    markdown.version, RENDER_REVISION,
+    ','.join(ext.__module__ + '.' + ext.__name__ for ext in EXTENSIONS))
+).encode('utf-8')).hexdigest()[:12]
+
+# Markdown field -> field holding its stored HTML
+HTML_FIELDS = {'incident_preview': 'incident_preview_html',
+               'incident_description': 'incident_description_html'}
+
+# Markdown instances keep state while converting, so one per thread
+local = threading.local()
+
+
+def render(text):
+    """
+    Renders markdown text to HTML with the incident extensions.
+    """
+    if not text:
+        return ''
+    instance = getattr(local, 'instance', None)
+    if instance is None:
+        instance = local.instance = markdown.Markdown(
+            extensions=[ext() for ext in EXTENSIONS])
+    try:
+        with metrics.MARKDOWN_RENDER.time():
+            return instance.convert(text)
+    finally:
+        instance.reset()
+
+
+def render_post(post_data):
+    """
+    Adds the rendered HTML fields and their version to post_data.
+    """
+    for field, html_field in HTML_FIELDS.items():
+        if field in post_data:
+            post_data[html_field] = render(post_data[field])
+    post_data['html_version'] = RENDER_VERSION
+    return post_data
+
+
+def rendered(post, field):
+    """
+    Returns the HTML of a markdown field, from the stored copy when it was
+    rendered with the current extensions and on the fly otherwise.
+    """
+    html_field = HTML_FIELDS[field]
+    if post.get('html_version') == RENDER_VERSION and \
+       post.get(html_field) is not None:
+        return Markup(post[html_field])
+    return Markup(render(post.get(field)))
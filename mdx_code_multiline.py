@@ -1,6 +1,7 @@
 from markdown import Extension
 from markdown.util import etree
 from markdown.inlinepatterns import Pattern
+from mdx_delimited import DelimitedMatcher
 
 RE = r'\[code\](.*?)\[\/code\]'
 
@@ -12,6 +13,13 @@ class MultilineCodeExtension(Extension):
 
 
 class NestedElements(Pattern):
+    """
+    Matches RE in linear time, see mdx_delimited.
+    """
+    def __init__(self, pattern, markdown_instance=None):
+        Pattern.__init__(self, pattern, markdown_instance)
+        self.compiled_re = DelimitedMatcher('[code]', '[/code]')
+
     def handleMatch(self, m):
         el1 = etree.Element('pre')
         el2 = etree.SubElement(el1, 'cite')
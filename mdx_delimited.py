@@ -0,0 +1,65 @@
+class DelimitedMatcher(object):
+    """
+    Drop-in replacement for the compiled regular expression of an inline
+    pattern shaped like r'^(.*?)OPEN(.*?)CLOSE(.*)$'.
+
+    Markdown wraps every inline pattern in '^(.*?)...(.*)$' and an
+    unmatched opener makes the regular expression rescan the rest of the
+    text once per opener, which is quadratic on bodies full of them. The
+    leftmost match is found here with two str.find calls instead: if the
+    first opener has no closer after it, no later opener can have one
+    either, so every call is linear in the length of the text.
+    """
+
+    def __init__(self, opener, closer, min_content=0, keep_opener=False):
+        self.opener = opener
+        self.closer = closer
+        self.min_content = min_content
+        self.keep_opener = keep_opener
+
+    def match(self, text):
+        start = text.find(self.opener)
+        if start == -1:
+            return None
+        content = start + len(self.opener)
+        end = text.find(self.closer, content + self.min_content)
+        if end == -1:
+            return None
+        rest = end + len(self.closer)
+
+        spans = [(0, start)]
+        if self.keep_opener:
+            spans.append((start, content))
+        spans.append((content, end))
+        spans.append((rest, len(text)))
+        return DelimitedMatch(text, spans)
+
+
+class DelimitedMatch(object):
+    """
+    The subset of the re match object API used by markdown.
+    """
+
+    def __init__(self, text, spans):
+        self.string = text
+        self.spans = spans
+
+    def group(self, index=0):
+        if index == 0:
+            return self.string
+        start, end = self.spans[index - 1]
+        return self.string[start:end]
+
+    def groups(self):
+        return tuple(self.string[start:end] for start, end in self.spans)
+
+    def span(self, index=0):
+        if index == 0:
+            return 0, len(self.string)
+        return self.spans[index - 1]
+
+    def start(self, index=0):
+        return self.span(index)[0]
+
+    def end(self, index=0):
+        return self.span(index)[1]
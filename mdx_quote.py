@@ -1,11 +1,22 @@
 import markdown
+from mdx_delimited import DelimitedMatcher
 
 BLOCKQUOTE_RE = r'(~{2})(.+?)\2'
 
 
+class QuotePattern(markdown.inlinepatterns.SimpleTagPattern):
+    """
+    Matches BLOCKQUOTE_RE in linear time, see mdx_delimited.
+    """
+    def __init__(self, tag):
+        markdown.inlinepatterns.SimpleTagPattern.__init__(self, BLOCKQUOTE_RE, tag)
+        self.compiled_re = DelimitedMatcher('~~', '~~', min_content=1,
+                                            keep_opener=True)
+
+
 class QuoteExtension(markdown.Extension):
     def extendMarkdown(self, md, md_globals):
-        md.inlinePatterns.add('blockquote', markdown.inlinepatterns.SimpleTagPattern(BLOCKQUOTE_RE, 'blockquote'), '>strong')
+        md.inlinePatterns.add('blockquote', QuotePattern('blockquote'), '>strong')
 
 
 def makeExtension(configs=None):
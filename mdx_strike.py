@@ -1,11 +1,22 @@
 import markdown
+from mdx_delimited import DelimitedMatcher
 
 STRIKE_RE = r'(-{2})(.+?)\2'
 
 
+class StrikePattern(markdown.inlinepatterns.SimpleTagPattern):
+    """
+    Matches STRIKE_RE in linear time, see mdx_delimited.
+    """
+    def __init__(self, tag):
+        markdown.inlinepatterns.SimpleTagPattern.__init__(self, STRIKE_RE, tag)
+        self.compiled_re = DelimitedMatcher('--', '--', min_content=1,
+                                            keep_opener=True)
+
+
 class StrikeExtension(markdown.Extension):
     def extendMarkdown(self, md, md_globals):
-        md.inlinePatterns.add('strike', markdown.inlinepatterns.SimpleTagPattern(STRIKE_RE, 'strike'), '>strong')
+        md.inlinePatterns.add('strike', StrikePattern('strike'), '>strong')
 
 
 def makeExtension(configs=None):
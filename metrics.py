@@ -0,0 +1,87 @@
+import os
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, REGISTRY, generate_latest)
+from prometheus_client import multiprocess
+
+
+# Directory the worker processes write their samples to, set by
+# gunicorn_config.py before the workers start. A scrape of any worker then
+# adds up the samples of all of them. Unset when running a single process.
+MULTIPROCESS_DIR = os.environ.get('prometheus_multiproc_dir')
+
+MONGODB_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+MARKDOWN_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+REQUEST_LATENCY = Histogram(
+    'incidentdb_request_duration_seconds', 'Time taken to answer a request',
+    ['endpoint', 'method'])
+REQUESTS = Counter(
+    'incidentdb_requests_total', 'Requests answered', ['endpoint', 'method', 'status'])
+REQUESTS_IN_PROGRESS = Gauge(
+    'incidentdb_requests_in_progress', 'Requests being answered', ['endpoint'],
+    multiprocess_mode='livesum')
+
+MONGODB_OPERATIONS = Counter(
+    'incidentdb_mongodb_operations_total', 'MongoDB commands run',
+    ['command', 'collection'])
+MONGODB_FAILURES = Counter(
+    'incidentdb_mongodb_operation_failures_total', 'MongoDB commands that failed',
+    ['command', 'collection'])
+MONGODB_LATENCY = Histogram(
+    'incidentdb_mongodb_operation_duration_seconds', 'Time taken by MongoDB commands',
+    ['command'], buckets=MONGODB_BUCKETS)
+
+MARKDOWN_RENDER = Histogram(
+    'incidentdb_markdown_render_seconds', 'Time taken to render a markdown field',
+    buckets=MARKDOWN_BUCKETS)
+
+CACHE_REQUESTS = Counter(
+    'incidentdb_cache_requests_total', 'Cache lookups by cache and result',
+    ['cache', 'result'])
+
+
+def endpoint_label(endpoint):
+    # Requests that match no route have no endpoint
+    return endpoint or 'unmatched'
+
+
+def request_started(endpoint):
+    REQUESTS_IN_PROGRESS.labels(endpoint_label(endpoint)).inc()
+
+
+def request_ended(endpoint):
+    REQUESTS_IN_PROGRESS.labels(endpoint_label(endpoint)).dec()
+
+
+def observe_request(endpoint, method, status, seconds):
+    endpoint = endpoint_label(endpoint)
+    REQUEST_LATENCY.labels(endpoint, method).observe(seconds)
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+
+
+def observe_operation(operation):
+    """
+    Counts a MongoDB operation recorded by instrumentation.QueryListener.
+    """
+    collection = operation['collection'] or ''
+    MONGODB_OPERATIONS.labels(operation['command'], collection).inc()
+    MONGODB_LATENCY.labels(operation['command']).observe(operation['duration_ms'] / 1000.0)
+    if operation.get('error'):
+        MONGODB_FAILURES.labels(operation['command'], collection).inc()
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def exposition():
+    """
+    Returns the body and content type of a scrape, aggregated over all
+    worker processes when running under gunicorn_config.py.
+    """
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
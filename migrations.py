@@ -0,0 +1,177 @@
+import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from helper_functions import random_string
+
+
+def index(*keys, **options):
+    options.setdefault('background', True)
+    return IndexModel(list(keys), **options)
+
+
+# Indexes every query shape needs, by config collection name. Indexes
+# found on these collections but not declared here are dropped.
+INDEXES = {
+    'POSTS_COLLECTION': [
+        # listings, keyset pagination and the sidebar (post.get_posts)
+        index(('date', DESCENDING), ('_id', DESCENDING)),
+        index(('tags', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)),
+        # single incident pages (post.get_post_by_permalink)
+        index(('permalink', ASCENDING), unique=True),
+        # facet filters (facets.make_condition): equality field, listing
+        # sort, then the initial compromise range
+        index(('incident_categories', ASCENDING), ('date', DESCENDING),
+              ('_id', DESCENDING), ('incident_time_initial_compromise', ASCENDING)),
+        index(('ttp_resource_infrastructure', ASCENDING), ('date', DESCENDING),
+              ('_id', DESCENDING), ('incident_time_initial_compromise', ASCENDING)),
+        index(('country_codes', ASCENDING), ('date', DESCENDING),
+              ('_id', DESCENDING), ('incident_time_initial_compromise', ASCENDING)),
+        index(('date', DESCENDING), ('_id', DESCENDING),
+              ('incident_time_initial_compromise', ASCENDING)),
+        # largest losses (post.get_top_losses)
+        index(('loss_usd_amount', DESCENDING)),
+        index(('loss_crypto_asset', ASCENDING), ('loss_crypto_amount', DESCENDING)),
+    ],
+    # users list (user.get_users), other lookups are by _id
+    'USERS_COLLECTION': [
+        index(('date', ASCENDING)),
+    ],
+    # candidate posts of a query (text_search.SearchIndex.search)
+    'SEARCH_COLLECTION': [
+        index(('terms', ASCENDING)),
+    ],
+}
+
+SCHEMA_ID = 'schema'
+
+
+def dedupe_permalinks(config):
+    """
+    Gives every post sharing a permalink with an older one a new
+    permalink, so the unique permalink index can be built.
+    """
+    collection = config['POSTS_COLLECTION']
+    duplicates = collection.aggregate([
+        {'$group': {'_id': '$permalink', 'ids': {'$push': '$_id'},
+                    'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}], allowDiskUse=True)
+    for duplicate in duplicates:
+        for post_id in sorted(duplicate['ids'])[1:]:
+            collection.update_one({'_id': post_id},
+                                  {'$set': {'permalink': random_string(12)}})
+
+
+def backfill_losses(config):
+    import post
+    post.Post(config).backfill_losses()
+
+
+def backfill_country_codes(config):
+    import post
+    post.Post(config).backfill_country_codes()
+
+
+def rebuild_search_index(config):
+    import text_search
+    text_search.SearchIndex(config).rebuild(config['POSTS_COLLECTION'])
+
+
+def rebuild_analytics(config):
+    import analytics
+    analytics.Analytics(config).rebuild()
+
+
+# Data migrations in the order they are applied, the schema version of a
+# database is the version of the last one applied. Append new migrations
+# with the next version, never renumber or remove applied ones.
+MIGRATIONS = [
+    (1, 'dedupe permalinks', dedupe_permalinks),
+    (2, 'backfill typed loss fields', backfill_losses),
+    (3, 'backfill country codes', backfill_country_codes),
+    (4, 'build text search index', rebuild_search_index),
+    (5, 'build analytics rollups', rebuild_analytics),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def key_spec(keys):
+    return [(field, int(direction) if isinstance(direction, (int, float))
+             else direction) for field, direction in keys]
+
+
+class Migrations:
+    """
+    Brings a database up to the schema the code expects.
+
+    run() applies the data migrations newer than the recorded schema
+    version, recording the version after each one so an interrupted run
+    resumes where it stopped, then syncs the indexes of every collection
+    with INDEXES. Both steps are idempotent, so it is safe to run on every
+    deploy.
+    """
+
+    def __init__(self, default_config, log=None):
+        self.config = default_config
+        self.collection = default_config['MIGRATIONS_COLLECTION']
+        self.log = log or (lambda message: None)
+
+    def get_version(self):
+        schema = self.collection.find_one({'_id': SCHEMA_ID})
+        return schema['version'] if schema else 0
+
+    def set_version(self, version, name):
+        self.collection.update_one(
+            {'_id': SCHEMA_ID},
+            {'$set': {'version': version},
+             '$push': {'applied': {'version': version, 'name': name,
+                                   'date': datetime.datetime.utcnow()}}},
+            upsert=True)
+
+    def pending(self):
+        version = self.get_version()
+        return [migration for migration in MIGRATIONS if migration[0] > version]
+
+    def run(self):
+        """
+        Applies pending migrations and syncs indexes. Returns the schema
+        version of the database.
+        """
+        for version, name, migrate in self.pending():
+            self.log('Applying %d: %s' % (version, name))
+            migrate(self.config)
+            self.set_version(version, name)
+
+        for config_name, models in sorted(INDEXES.items()):
+            self.sync_indexes(self.config[config_name], models)
+        return self.get_version()
+
+    def sync_indexes(self, collection, models):
+        """
+        Creates the declared indexes missing from collection, rebuilds the
+        ones whose keys or uniqueness changed and drops undeclared ones.
+        New indexes are created before obsolete ones are dropped.
+        """
+        existing = collection.index_information()
+        wanted = dict((model.document['name'], model) for model in models)
+
+        changed = []
+        for name, info in existing.items():
+            model = wanted.get(name)
+            if model is not None and (
+                    key_spec(info['key']) != key_spec(model.document['key'].items()) or
+                    bool(info.get('unique')) != bool(model.document.get('unique'))):
+                changed.append(name)
+
+        missing = [model for name, model in wanted.items() if name not in existing]
+        if missing:
+            self.log('Creating indexes on %s: %s' % (
+                collection.name, ', '.join(model.document['name'] for model in missing)))
+            collection.create_indexes(missing)
+
+        for name in sorted(existing):
+            if name != '_id_' and (name not in wanted or name in changed):
+                self.log('Dropping index %s.%s' % (collection.name, name))
+                collection.drop_index(name)
+        if changed:
+            self.log('Rebuilding indexes on %s: %s' % (collection.name, ', '.join(changed)))
+            collection.create_indexes([wanted[name] for name in changed])
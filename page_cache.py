@@ -0,0 +1,220 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from pymongo import ReturnDocument
+import database
+import metrics
+
+
+class ContentGeneration:
+    """
+    Global content generation number, bumped by every write that changes
+    what public pages show.
+
+    The number lives in COUNTERS_COLLECTION so all workers share it. Each
+    process re-reads it at most once per ttl seconds, a bump made by the
+    process itself is seen immediately.
+    """
+
+    ID = 'content_generation'
+
+    # Shared by every instance in the process, see Post.cache
+    value = None
+    expires = 0
+
+    def __init__(self, default_config):
+        self.collection = default_config['COUNTERS_COLLECTION']
+        self.ttl = default_config.get('PAGE_CACHE_GENERATION_TTL', 1)
+
+    def get(self):
+        if ContentGeneration.value is None or time.time() >= ContentGeneration.expires:
+            # Always from the primary, like the content of every page that
+            # is cached, so a page is never filed under a generation newer
+            # than the content it was rendered from
+            with database.reading_from(None):
+                counter = self.collection.find_one({'_id': self.ID})
+            ContentGeneration.value = counter['value'] if counter else 0
+            ContentGeneration.expires = time.time() + self.ttl
+        return ContentGeneration.value
+
+    def bump(self):
+        counter = self.collection.find_one_and_update(
+            {'_id': self.ID}, {'$inc': {'value': 1}}, upsert=True,
+            return_document=ReturnDocument.AFTER)
+        ContentGeneration.value = counter['value']
+        ContentGeneration.expires = time.time() + self.ttl
+
+
+class MemoryBackend:
+    """
+    Least recently used page store holding at most max_bytes of pages.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(key, page):
+        return len(key[1]) + len(page[2]) + 256
+
+    def get(self, key):
+        with self.lock:
+            page = self.entries.get(key)
+            if page is not None:
+                self.entries.move_to_end(key)
+            return page
+
+    def set(self, key, page):
+        size = self.entry_size(key, page)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.entry_size(key, old)
+            self.entries[key] = page
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old = self.entries.popitem(last=False)
+                self.size -= self.entry_size(old_key, old)
+
+
+class DiskBackend:
+    """
+    Page store in a directory shared by the workers of a host, holding at
+    most about max_bytes of pages.
+
+    Files are named after the generation and a hash of the URL and written
+    atomically. Pages of older generations can never be hit again, they
+    are deleted the first time a page of a newer generation is stored.
+
+    Every URL with a different query string is a different page, so once
+    the directory is full further pages are not stored until the next
+    generation empties it. The size is measured on clean and every
+    RESCAN_SETS stores, as the other workers write there too.
+    """
+
+    RESCAN_SETS = 100
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cleaned = None
+        self.size = 0
+        self.sets = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, generation, url):
+        name = '%d-%s' % (generation, hashlib.sha1(url.encode('utf-8')).hexdigest())
+        return os.path.join(self.directory, name)
+
+    def get(self, key):
+        try:
+            with open(self.path(*key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, page):
+        generation = key[0]
+        with self.lock:
+            if self.cleaned != generation:
+                self.clean(generation)
+            elif self.sets % self.RESCAN_SETS == 0:
+                self.size = self.measure()
+            self.sets += 1
+            data = pickle.dumps(page, pickle.HIGHEST_PROTOCOL)
+            if self.size + len(data) > self.max_bytes:
+                return
+            self.size += len(data)
+
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, self.path(*key))
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def measure(self):
+        size = 0
+        for entry in os.scandir(self.directory):
+            try:
+                size += entry.stat().st_size
+            except OSError:
+                pass
+        return size
+
+    def clean(self, generation):
+        self.cleaned = generation
+        for name in os.listdir(self.directory):
+            prefix = name.split('-', 1)[0]
+            if prefix.isdigit() and int(prefix) < generation:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        self.size = self.measure()
+
+
+class PageCache:
+    """
+    Rendered responses of public pages keyed by (generation, URL).
+
+    Pages are (status, headers, body) tuples looked up in memory first,
+    then in the optional shared disk backend. A write bumps the content
+    generation so every cached page stops matching at once.
+    """
+
+    # Response headers kept with a cached page
+    HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+    def __init__(self, default_config, name='pages'):
+        self.name = name
+        self.generation = ContentGeneration(default_config)
+        self.backends = []
+        if default_config.get('PAGE_CACHE_BYTES'):
+            self.backends.append(MemoryBackend(default_config['PAGE_CACHE_BYTES']))
+        if default_config.get('PAGE_CACHE_DIR'):
+            self.backends.append(DiskBackend(default_config['PAGE_CACHE_DIR'],
+                                             default_config.get('PAGE_CACHE_DIR_BYTES',
+                                                                256 * 1024 * 1024)))
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return bool(self.backends)
+
+    def key(self, url):
+        return self.generation.get(), url
+
+    def get(self, key):
+        for index, backend in enumerate(self.backends):
+            page = backend.get(key)
+            if page is not None:
+                self.hits += 1
+                metrics.cache_lookup(self.name, True)
+                # promote to the faster backends
+                for faster in self.backends[:index]:
+                    faster.set(key, page)
+                return page
+        self.misses += 1
+        metrics.cache_lookup(self.name, False)
+        return None
+
+    def set(self, key, response):
+        headers = [(name, value) for name, value in response.headers
+                   if name in self.HEADERS]
+        page = (response.status_code, headers, response.get_data())
+        for backend in self.backends:
+            backend.set(key, page)
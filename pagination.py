@@ -1,27 +1,63 @@
+import base64
+import calendar
+import datetime
 from math import ceil
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
 
 
 class Pagination(object):
+    """
+    Renders either numbered pages (page/total_count) or, when a cursor
+    is given, keyset pages with only prev/next links.
 
-    def __init__(self, page, per_page, total_count):
+    A total_count above count_cap is treated as "more than count_cap":
+    the last pages are not linked and has_next relies on next_cursor.
+    """
+
+    def __init__(self, page, per_page, total_count,
+                 next_cursor=None, prev_cursor=None, cursor_mode=False,
+                 count_cap=None):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.cursor_mode = cursor_mode
+        self.count_cap = count_cap
+
+    @property
+    def is_capped(self):
+        return bool(self.count_cap) and self.total_count > self.count_cap
+
+    @property
+    def total_label(self):
+        if self.is_capped:
+            return '%d+' % self.count_cap
+        return str(self.total_count)
 
     @property
     def pages(self):
+        if self.is_capped:
+            return max(int(ceil(self.count_cap / float(self.per_page))), self.page)
         return int(ceil(self.total_count / float(self.per_page)))
 
     @property
     def has_prev(self):
+        if self.cursor_mode:
+            return self.prev_cursor is not None
         return self.page > 1
 
     @property
     def has_next(self):
+        if self.cursor_mode or self.is_capped:
+            return self.next_cursor is not None
         return self.page < self.pages
 
     def iter_pages(self, left_edge=2, left_current=2,
                    right_current=5, right_edge=2):
+        if self.is_capped:
+            right_edge = 0
         last = 0
         for num in range(1, self.pages + 1):
             if num <= left_edge or (num > self.page - left_current - 1 and num < self.page + right_current) or num > self.pages - right_edge:
@@ -29,3 +65,34 @@ class Pagination(object):
                     yield None
                 yield num
                 last = num
+
+
+def encode_cursor(post):
+    """
+    Encodes the (date, _id) sort key of a post into an opaque token.
+    """
+    date = post['date']
+    micros = calendar.timegm(date.utctimetuple()) * 1000000 + date.microsecond
+    raw = '%d.%s' % (micros, post['id'] if 'id' in post else post['_id'])
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decodes a token made by encode_cursor into a (date, ObjectId) tuple.
+
+    Returns None if the token is malformed or its date is before 1970 or
+    past the year 9999, which no post date can be.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+        micros, post_id = raw.split('.', 1)
+        micros = int(micros)
+        if micros < 0:
+            return None
+        date = datetime.datetime(1970, 1, 1) + \
+            datetime.timedelta(microseconds=micros)
+        return date, ObjectId(post_id)
+    except (ValueError, TypeError, UnicodeError, OverflowError, InvalidId):
+        return None
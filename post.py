@@ -3,104 +3,297 @@ from dateutil.parser import parse
 import cgi
 from bson.objectid import ObjectId
 from helper_functions import *
+import re
+import cache
+import pagination
+import text_search
+import markdown_render
+import analytics
+import loss
+import geography
+import facets
+import api
+import page_cache
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ExecutionTimeout
 
 
 class Post:
 
+    # Shared by every Post instance in the process so writes made through
+    # any of them (e.g. the one used by Settings.install) invalidate it
+    cache = cache.WriteCache(name='post')
+
+    # Fields read for each listing shape, 'date' is always needed to build
+    # pagination cursors
+    SHAPES = {
+        'link': ['incident_title', 'date', 'permalink'],
+        'card': ['incident_title', 'incident_preview', 'incident_categories',
+                 'incident_time_initial_compromise',
+                 'loss_crypto', 'loss_usd',
+                 'incident_preview_html', 'html_version',
+                 'date', 'permalink', 'author'],
+        'feed': ['incident_title', 'incident_preview', 'incident_description',
+                 'incident_preview_html', 'incident_description_html',
+                 'html_version',
+                 'date', 'modified', 'permalink', 'author'],
+        'full': ['incident_title', 'incident_preview', 'incident_description',
+                 'incident_preview_html', 'incident_description_html',
+                 'html_version',
+                 'ttp_resource_infrastructure', 'incident_categories',
+                 'ttp_description', 'ttp_exploits_targets',
+                 'incident_time_initial_compromise',
+                 'incident_time_incident_reported',
+                 'loss_crypto', 'loss_usd', 'description_geographical',
+                 'references', 'advanced',
+                 'date', 'permalink', 'author', 'comments'],
+        # enough to compute the ETag of an API page
+        'version': api.VERSION_FIELDS,
+        'api': api.FIELDS,
+    }
+
     def __init__(self, default_config):
         self.collection = default_config['POSTS_COLLECTION']
-        self.response = {'error': None, 'data': None}
+        self.config = default_config
+        self.search_index = text_search.SearchIndex(default_config)
+        self.analytics = analytics.Analytics(default_config)
+        self.generation = page_cache.ContentGeneration(default_config)
         self.debug_mode = default_config['DEBUG']
+        self.cache.generation = self.generation
+        self.cache.ttl = default_config.get('POSTS_CACHE_TTL', self.cache.ttl)
+        self.cache.max_entries = default_config.get('POSTS_CACHE_ENTRIES',
+                                                    self.cache.max_entries)
+
+    def get_posts(self, limit, skip, tag=None, search=None,
+                  after=None, before=None, shape='full', filters=None):
+        """
+        Returns a page of posts ordered by (date, _id) descending.
+
+        shape names one of Post.SHAPES and decides which fields are read
+        from MongoDB, listings should ask for the smallest one they render.
+
+        Pages are either addressed by skip, or by keyset when after/before
+        is given as a (date, _id) tuple from pagination.decode_cursor, in
+        which case the query seeks straight to the page through the
+        (date, _id) index instead of walking skip documents.
+
+        Besides 'data' the response holds 'next_cursor' and 'prev_cursor'
+        tokens, None when there is no page in that direction, and 'count'
+        when the total was computed along with the page (text search).
+
+        filters narrows the listing down by facet, see facets.parse_filters.
+        """
+        if search is not None and self.config['SEARCH']:
+            return self.search_posts(limit, skip, search, shape)
+        response = self.new_listing()
+        cond = self.get_condition(tag, search, filters)
+        direction = -1
+        if after is not None:
+            cond = self.add_seek(cond, after, '$lt')
+        elif before is not None:
+            cond = self.add_seek(cond, before, '$gt')
+            direction = 1
+        fields = self.SHAPES[shape]
+        projection = dict.fromkeys(fields, 1)
+        try:
+            cursor = self.collection.find(cond, projection).sort(
+                [('date', direction), ('_id', direction)])
+            if after is None and before is None:
+                cursor = cursor.skip(skip)
+            # One extra document tells whether there is a further page
+            cursor = cursor.limit(limit + 1)
+            response['data'] = [self.make_row(post, fields) for post in cursor]
+
+            more = len(response['data']) > limit
+            del response['data'][limit:]
+            if before is not None:
+                response['data'].reverse()
+
+            data = response['data']
+            if data:
+                if more or before is not None:
+                    response['next_cursor'] = pagination.encode_cursor(data[-1])
+                if (before is not None and more) or after is not None or \
+                   (after is None and before is None and skip > 0):
+                    response['prev_cursor'] = pagination.encode_cursor(data[0])
+
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+            response['error'] = 'Posts not found..'
+
+        return response
+
+    def search_posts(self, limit, skip, search, shape='full'):
+        """
+        Returns a page of posts ranked by the text search index, with the
+        total number of matches in 'count'.
+        """
+        response = self.new_listing()
+        try:
+            ids, response['count'] = self.search_index.search(
+                search, limit, skip)
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+            response['error'] = 'Posts not found..'
+            return response
+
+        posts = self.get_posts_by_ids(ids, shape)
+        response['error'], response['data'] = posts['error'], posts['data']
+        return response
+
+    def get_posts_by_ids(self, ids, shape='full'):
+        """
+        Returns the posts with the given ids in the order of ids, leaving
+        out the ones that no longer exist.
+        """
+        response = {'error': None, 'data': []}
+        fields = self.SHAPES[shape]
+        if not ids:
+            return response
+        try:
+            cursor = self.collection.find(
+                {'_id': {'$in': ids}}, dict.fromkeys(fields, 1))
+            posts = dict((post['_id'], post) for post in cursor)
+            response['data'] = [self.make_row(posts[post_id], fields)
+                                for post_id in ids if post_id in posts]
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+            response['error'] = 'Posts not found..'
+            response['data'] = None
+
+        return response
 
-    def get_posts(self, limit, skip, tag=None, search=None):
-        self.response['error'] = None
+    @staticmethod
+    def new_listing():
+        return {'error': None, 'data': None, 'next_cursor': None,
+                'prev_cursor': None, 'count': None}
+
+    @staticmethod
+    def make_row(post, fields):
+        row = {'id': post['_id']}
+        for field in fields:
+            row[field] = post.get(field)
+        if 'comments' in fields and row['comments'] is None:
+            row['comments'] = []
+        return row
+
+    @staticmethod
+    def get_condition(tag=None, search=None, filters=None):
         cond = {}
         if tag is not None:
             cond = {'tags': tag}
         elif search is not None:
+            search = re.escape(search)
             cond = {'$or': [
                     {'incident_title': {'$regex': search, '$options': 'i'}},
                     {'incident_description': {'$regex': search, '$options': 'i'}}]}
-        try:
-            cursor = self.collection.find(cond).sort(
-                'date', direction=-1).skip(skip).limit(limit)
-            self.response['data'] = []
-            for post in cursor:
-                if 'comments' not in post:
-                    post['comments'] = []
-
-                self.response['data'].append({
-                    'id': post['_id'],
-                    'incident_title': post['incident_title'],
-                    'incident_preview': post['incident_preview'],
-                    'incident_description': post['incident_description'],
-                    'ttp_resource_infrastructure': post['ttp_resource_infrastructure'],
-                    'incident_categories': post['incident_categories'],
-                    'ttp_description': post['ttp_description'],
-                    'ttp_exploits_targets': post['ttp_exploits_targets'],
-                    'incident_time_initial_compromise': post['incident_time_initial_compromise'],
-                    'incident_time_incident_reported': post['incident_time_incident_reported'],
-
-                    'loss_crypto': post['loss_crypto'],
-                    'loss_usd': post['loss_usd'],
-                    'description_geographical': post['description_geographical'],
-                    'references': post['references'],
-                    'advanced': post['advanced'],
-
-                    'date': post['date'],
-                    'permalink': post['permalink'],
-                    'author': post['author'],
-                    'comments': post['comments']})
-
-        except Exception as e:
-            self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Posts not found..'
+        if filters:
+            cond.update(facets.make_condition(filters))
+        return cond
 
-        return self.response
+    @staticmethod
+    def add_seek(cond, position, op):
+        """
+        Restricts cond to posts strictly past position, a (date, _id) tuple,
+        in the direction given by op ('$lt' for older, '$gt' for newer).
+        """
+        date, post_id = position
+        seek = {'$or': [{'date': {op: date}},
+                        {'date': date, '_id': {op: post_id}}]}
+        if not cond:
+            return seek
+        return {'$and': [cond, seek]}
 
     def get_post_by_permalink(self, permalink):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
-            self.response['data'] = self.collection.find_one(
+            response['data'] = self.collection.find_one(
                 {'permalink': permalink})
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Post not found..'
+            response['error'] = 'Post not found..'
 
-        return self.response
+        return response
 
     def get_post_by_id(self, post_id):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
-            self.response['data'] = self.collection.find_one(
+            response['data'] = self.collection.find_one(
                 {'_id': ObjectId(post_id)})
-            if self.response['data']:
-                if 'tags' not in self.response['data']:
-                    self.response['data']['tags'] = ''
+            if response['data']:
+                if 'tags' not in response['data']:
+                    response['data']['tags'] = ''
                 else:
-                    self.response['data']['tags'] = ','.join(
-                        self.response['data']['tags'])
+                    response['data']['tags'] = ','.join(
+                        response['data']['tags'])
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Post not found..'
+            response['error'] = 'Post not found..'
 
-        return self.response
+        return response
 
-    def get_total_count(self, tag=None, search=None):
-        cond = {}
-        if tag is not None:
-            cond = {'tags': tag}
-        elif search is not None:
-            cond = {'$or': [
-                    {'incident_title': {'$regex': search, '$options': 'i'}},
-                    {'incident_description': {'$regex': search, '$options': 'i'}}]}
+    def get_total_count(self, tag=None, search=None, filters=None):
+        """
+        Returns the number of posts matching tag/search/filters, cached
+        until the next write.
+
+        The unfiltered total comes from the collection metadata. Filtered
+        counts stop at COUNT_CAP + 1 when COUNT_CAP is set, so a result
+        above the cap only means "more than COUNT_CAP". Search counts scan
+        every incident, so they also stop after SEARCH_COUNT_MS and are
+        then reported as more than COUNT_CAP.
+        """
+        def build():
+            try:
+                if tag is None and search is None and not filters:
+                    return self.collection.estimated_document_count(), True
+                cond = self.get_condition(tag, search, filters)
+                cap = self.config.get('COUNT_CAP')
+                if cap:
+                    options = {'limit': cap + 1}
+                    if search is not None and self.config.get('SEARCH_COUNT_MS'):
+                        options['maxTimeMS'] = self.config['SEARCH_COUNT_MS']
+                    try:
+                        return self.collection.count_documents(cond, **options), True
+                    except ExecutionTimeout:
+                        return cap + 1, True
+                return self.collection.count_documents(cond), True
+            except Exception as e:
+                self.print_debug_info(e, self.debug_mode)
+                return 0, False
+
+        return self.cache.get(('count', tag, search, facets.cache_key(filters)),
+                              build)
+
+    def get_facets(self, filters=None, limit=20):
+        """
+        Returns the facet value counts of the posts matching filters, see
+        facets.make_facets, computed by one aggregation.
 
-        return self.collection.find(cond).count()
+        Only the unfiltered counts are cached until the next write, the
+        filters come from /browse query strings and filtered pages are
+        kept by the page cache instead.
+        """
+        def build():
+            try:
+                result = list(self.collection.aggregate(facets.make_pipeline(
+                    self.get_condition(filters=filters), limit)))
+                return facets.make_facets(result[0] if result else {}), True
+            except Exception as e:
+                self.print_debug_info(e, self.debug_mode)
+                return [], False
+
+        if filters:
+            return build()[0]
+        return self.cache.get(('facets', limit), build)
 
     def get_tags(self):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
-            self.response['data'] = list(self.collection.aggregate([
+            response['data'] = list(self.collection.aggregate([
+                # Only tagged posts, found through the tags index instead
+                # of scanning the whole collection
+                {'$match': {'tags': {'$type': 'string'}}},
                 {'$unwind': '$tags'},
                 {'$group': {'_id': '$tags', 'count': {'$sum': 1}}},
                 {'$sort': {'count': -1}},
@@ -109,49 +302,253 @@ class Post:
             ]))
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Get tags error..'
+            response['error'] = 'Get tags error..'
+
+        return response
+
+    def get_recent_posts(self, limit=10):
+        """
+        Returns the most recent incidents for the sidebar from the write cache.
+        """
+        def build():
+            response = self.get_posts(limit, 0, shape='link')
+            if response['error']:
+                return [], False
+            return response['data'], True
 
-        return self.response
+        return self.cache.get(('recent_posts', limit), build)
+
+    def get_top_tags(self):
+        """
+        Returns the most used tags from the write cache.
+        """
+        def build():
+            response = self.get_tags()
+            if response['error']:
+                return [], False
+            return response['data'], True
+
+        return self.cache.get('top_tags', build)
+
+    def get_top_losses(self, limit=50):
+        """
+        Returns the incidents with the largest USD loss, walked from the
+        loss_usd_amount index and cached until the next write.
+        """
+        def build():
+            fields = self.SHAPES['link'] + ['loss_usd', 'loss_usd_amount']
+            try:
+                cursor = self.collection.find(
+                    {'loss_usd_amount': {'$gt': 0}}, dict.fromkeys(fields, 1)) \
+                    .sort('loss_usd_amount', -1).limit(limit)
+                return [self.make_row(post, fields) for post in cursor], True
+            except Exception as e:
+                self.print_debug_info(e, self.debug_mode)
+                return [], False
+
+        return self.cache.get(('top_losses', limit), build)
+
+    def content_changed(self):
+        """
+        Invalidates the write cache and moves cached pages to a new
+        content generation.
+        """
+        self.cache.invalidate()
+        self.generation.bump()
+
+    def post_written(self, post_id, post_data, old_post=None):
+        """
+        Brings caches and derived data up to date after a post was created,
+        or edited from old_post into post_data.
+        """
+        try:
+            self.content_changed()
+            self.search_index.index_post(post_id, post_data)
+            self.analytics.apply(old_post, post_data)
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+
+    def posts_inserted(self, posts):
+        """
+        Bulk version of post_written for newly inserted posts.
+        """
+        try:
+            self.content_changed()
+            self.search_index.index_new_posts(posts)
+            self.analytics.apply_many(posts)
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+
+    def post_deleted(self, post_id, old_post):
+        """
+        Removes a deleted post from caches and derived data.
+        """
+        try:
+            self.content_changed()
+            self.search_index.remove_post(post_id)
+            self.analytics.apply(old_post, None)
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+
+    def rerender_stale(self, batch_size=200):
+        """
+        Re-renders the stored HTML of posts rendered with another extension
+        set, in batches. Returns the number of posts updated.
+
+        modified is set too, so API ETags and cached STIX objects of the
+        posts change with them.
+        """
+        modified = datetime.datetime.utcnow()
+        fields = dict.fromkeys(markdown_render.HTML_FIELDS, 1)
+        cursor = self.collection.find(
+            {'html_version': {'$ne': markdown_render.RENDER_VERSION}},
+            fields).batch_size(batch_size)
+        requests = []
+        updated = 0
+        for post in cursor:
+            html = markdown_render.render_post(
+                dict((field, post.get(field)) for field in fields))
+            html['modified'] = modified
+            requests.append(UpdateOne({'_id': post['_id']}, {'$set': html}))
+            if len(requests) >= batch_size:
+                self.collection.bulk_write(requests, ordered=False)
+                updated += len(requests)
+                requests = []
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+            updated += len(requests)
+        if updated:
+            self.content_changed()
+        return updated
+
+    def backfill_losses(self, batch_size=500):
+        """
+        Sets the typed loss fields of posts stored before they existed, in
+        batches. Returns the number of posts updated.
+        """
+        def derive(post):
+            loss.normalize(post)
+            return dict((field, post[field]) for field in loss.FIELDS)
+
+        return self.backfill('loss_usd_amount', ['loss_usd', 'loss_crypto'],
+                             derive, batch_size)
+
+    def backfill_country_codes(self, batch_size=500):
+        """
+        Sets the normalized country codes of posts stored before they
+        existed, in batches. Returns the number of posts updated.
+        """
+        def derive(post):
+            return {'country_codes': geography.country_codes(
+                post.get('description_geographical'))}
+
+        return self.backfill('country_codes', ['description_geographical'],
+                             derive, batch_size)
+
+    def backfill(self, field, source_fields, derive, batch_size=500):
+        """
+        Sets the fields returned by derive(post) on every post missing
+        field, reading only source_fields and writing in batches.
+
+        modified is set too, so API ETags and cached STIX objects of the
+        posts change with them.
+        """
+        modified = datetime.datetime.utcnow()
+        cursor = self.collection.find(
+            {field: {'$exists': False}},
+            dict.fromkeys(source_fields, 1)).batch_size(batch_size)
+        requests = []
+        updated = 0
+        for post in cursor:
+            fields = derive(post)
+            fields['modified'] = modified
+            requests.append(UpdateOne({'_id': post['_id']}, {'$set': fields}))
+            if len(requests) >= batch_size:
+                self.collection.bulk_write(requests, ordered=False)
+                updated += len(requests)
+                requests = []
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+            updated += len(requests)
+        if updated:
+            self.content_changed()
+        return updated
 
     def create_new_post(self, post_data):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
-            self.response['data'] = self.collection.insert(post_data)
+            markdown_render.render_post(post_data)
+            response['data'] = self.collection.insert(post_data)
+            self.post_written(response['data'], post_data)
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Adding post error..'
+            response['error'] = 'Adding post error..'
 
-        return self.response
+        return response
+
+    def create_new_posts(self, posts):
+        """
+        Inserts validated posts with one unordered insert_many.
+
+        The response data holds the ids of the inserted posts and
+        'failed' maps the index of every rejected post to its error.
+        """
+        response = {'error': None, 'data': [], 'failed': {}}
+        if not posts:
+            return response
+
+        for post_data in posts:
+            markdown_render.render_post(post_data)
+        try:
+            self.collection.insert_many(posts, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                response['failed'][error['index']] = error['errmsg']
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+            response['error'] = 'Adding posts error..'
+            return response
+
+        inserted = [post_data for index, post_data in enumerate(posts)
+                    if index not in response['failed']]
+        self.posts_inserted(inserted)
+        response['data'] = [post_data['_id'] for post_data in inserted]
+        return response
 
     def edit_post(self, post_id, post_data):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
 
         del post_data['date']
         #del post_data['permalink']
 
         try:
-            self.collection.update(
+            markdown_render.render_post(post_data)
+            old_post = self.collection.find_one_and_update(
                 {'_id': ObjectId(post_id)}, {"$set": post_data}, upsert=False)
-            self.response['data'] = True
+            if old_post:
+                self.post_written(old_post['_id'], dict(old_post, **post_data), old_post)
+            response['data'] = True
 
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Post update error..'
+            response['error'] = 'Post update error..'
 
-        return self.response
+        return response
 
     def delete_post(self, post_id):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
-            if self.get_post_by_id(post_id) and self.collection.remove({'_id': ObjectId(post_id)}):
-                self.response['data'] = True
+            old_post = self.collection.find_one_and_delete({'_id': ObjectId(post_id)})
+            if old_post:
+                self.post_deleted(old_post['_id'], old_post)
+                response['data'] = True
             else:
-                self.response['data'] = False
+                response['data'] = False
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Deleting post error..'
+            response['error'] = 'Deleting post error..'
 
-        return self.response
+        return response
 
     @staticmethod
     def validate_post_data(post_data):
@@ -198,7 +595,12 @@ class Post:
                 'author'
                 'comments'
             ADDED by this method
+            +   'loss_usd_amount'
+            +   'loss_crypto_amount'
+            +   'loss_crypto_asset'
+            +   'country_codes'
             +   'date'
+            +   'modified'
             +   'permalink'
 
         :rtype: dictionary
@@ -227,7 +629,7 @@ class Post:
 
 
         try:
-            post_data['inciden_categories'] = cgi.escape(post_data['incident_categories'])
+            post_data['incident_categories'] = cgi.escape(post_data['incident_categories'])
         except:
             post_data['incident_categories'] = None
 
@@ -283,12 +685,16 @@ class Post:
         except:
             post_data['references'] = None
 
+        # Numeric loss amounts for sorting, range queries and sums
+        loss.normalize(post_data)
+        post_data['country_codes'] = geography.country_codes(
+            post_data['description_geographical'])
+
         # append to to post_data
         post_data['date'] = datetime.datetime.utcnow()
+        post_data['modified'] = post_data['date']
         post_data['permalink'] = permalink
 
-        print(post_data)
-
         return post_data
 
     @staticmethod
@@ -1,4 +1,7 @@
+import time
 from flask import session
+import database
+import page_cache
 
 
 class Settings:
@@ -12,53 +15,118 @@ class Settings:
         self.config['BLOG_TITLE'] = 'Blog'
         self.config['BLOG_DESCRIPTION'] = ''
 
-        self.response = {'error': None, 'data': None}
+        # Process local settings cache, refreshed from MongoDB once the TTL
+        # runs out or when it is invalidated by a settings write
+        self.cache_ttl = default_config.get('SETTINGS_CACHE_TTL', 60)
+        self.cache_expires = 0
+        self.cache_generation = None
+
+        # Settings show up on every page, writes start a new page generation
+        self.generation = page_cache.ContentGeneration(default_config)
+
+        # One-way installed latch, see is_installed
+        self.installed = False
+
         self.debug_mode = default_config['DEBUG']
 
     def get_config(self):
+        """
+        Returns the config with the stored blog settings applied.
+
+        The settings document is only read when the cache has expired, so
+        the shared config is written at most once per SETTINGS_CACHE_TTL
+        seconds instead of on every request. A newer content generation,
+        bumped by a settings write in another worker, expires it at once.
+        """
+        generation = self.generation.get()
+        if time.time() < self.cache_expires and generation == self.cache_generation:
+            return self.config
+
         try:
-            cursor = self.collection.find_one()
+            with database.reading_from(None):
+                cursor = self.collection.find_one()
             if cursor:
-                self.config['PER_PAGE'] = cursor.get(
-                    'per_page', self.config['PER_PAGE'])
-                self.config['SEARCH'] = cursor.get(
-                    'use_search', self.config['SEARCH'])
-                self.config['BLOG_TITLE'] = cursor.get(
-                    'title', self.config['BLOG_TITLE'])
-                self.config['BLOG_DESCRIPTION'] = cursor.get(
-                    'description', self.config['BLOG_DESCRIPTION'])
+                # One update, so concurrent requests never see a mix of
+                # old and new settings
+                self.config.update({
+                    'PER_PAGE': cursor.get('per_page', self.config['PER_PAGE']),
+                    'SEARCH': bool(cursor.get('text_search', self.config['SEARCH'])),
+                    'BLOG_TITLE': cursor.get('title', self.config['BLOG_TITLE']),
+                    'BLOG_DESCRIPTION': cursor.get(
+                        'description', self.config['BLOG_DESCRIPTION'])})
+            self.cache_expires = time.time() + self.cache_ttl
+            self.cache_generation = generation
             return self.config
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'System error..'
+            return self.config
+
+    def invalidate_cache(self):
+        self.cache_expires = 0
 
     def is_installed(self):
-        users_cnt = self.config['USERS_COLLECTION'].find().count()
-        if users_cnt > 0:
-            session['installed'] = True
-            return True
-        else:
-            session['installed'] = False
-            return False
+        """
+        Checks whether the blog has been installed.
+
+        Installation is one-way, so once it has been seen the result is
+        latched in memory and later calls make no MongoDB round trips. The
+        latch is also persisted as an 'installed' marker on the settings
+        document so new workers can set it with a single lookup, the
+        collection only holds that one document.
+        """
+        if not self.installed:
+            try:
+                if self.collection.find_one({'installed': True}, {'_id': 1}):
+                    self.installed = True
+                elif self.config['USERS_COLLECTION'].find_one({}, {'_id': 1}):
+                    # Installed before the marker existed, persist it now
+                    self.collection.update_one({}, {'$set': {'installed': True}})
+                    self.installed = True
+            except Exception as e:
+                self.print_debug_info(e, self.debug_mode)
+                return False
+
+        if session.get('installed') != self.installed:
+            session['installed'] = self.installed
+        return self.installed
+
+    def clear_installed(self):
+        """
+        Clears the installed latch and its persisted marker.
+        """
+        self.installed = False
+        try:
+            self.collection.update_many({}, {'$unset': {'installed': ''}})
+        except Exception as e:
+            self.print_debug_info(e, self.debug_mode)
+
+    def uninstall(self):
+        """
+        Drops the blog collections, and the search index, analytics
+        rollups and STIX cache derived from the incidents, so the install
+        page shows up again and the next install starts from nothing.
+        """
+        self.clear_installed()
+        for name in ('POSTS_COLLECTION', 'USERS_COLLECTION', 'SEARCH_COLLECTION',
+                     'ANALYTICS_COLLECTION', 'STIX_COLLECTION'):
+            self.config[name].drop()
+        self.collection.drop()
+        self.invalidate_cache()
+        self.generation.bump()
 
     def install(self, blog_data, user_data):
         import user
         import post
+        import migrations
 
         print("Installing")
 
         userClass = user.User(self.config)
         postClass = post.Post(self.config)
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
 
         try:
-            self.config['POSTS_COLLECTION'].ensure_index([('date', -1)])
-            self.config['POSTS_COLLECTION'].ensure_index(
-                [('tags', 1), ('date', -1)])
-            self.config['POSTS_COLLECTION'].ensure_index([('permalink', 1)])
-            self.config['POSTS_COLLECTION'].ensure_index(
-                [('query', 1), ('orderby', 1)])
-            self.config['USERS_COLLECTION'].ensure_index([('date', 1)])
+            migrations.Migrations(self.config).run()
 
             incident_description = """Lorem ipsum dolor sit amet, consectetur \
             adipisicing elit, sed do eiusmod tempor incididunt ut labore et \
@@ -72,7 +140,7 @@ class Settings:
 
             post_data = {'incident_title': 'Hello World!',
                          'incident_description': incident_description,
-                         'ttp_resources_infrastructure': 'Test Blockchain Platform',
+                         'ttp_resource_infrastructure': 'Test Blockchain Platform',
                          'incident_categories' : 'Smart Contract',
                          'ttp_description': 'Test vulnerability',
                          'ttp_exploits_targets': 'Test source of attack',
@@ -91,35 +159,40 @@ class Settings:
 
             if blog_data['per_page'].isdigit():
                 blog_settings_error = None
+                blog_data['installed'] = True
                 self.collection.insert(blog_data)
             else:
                 blog_settings_error = '"Per page" field need to be integer..'
 
+            self.invalidate_cache()
+
             if user_create['error'] or post_create['error'] or blog_settings_error:
-                self.response['error'] = []
-                self.response['error'].append(user_create['error'])
-                self.response['error'].append(post_create['error'])
-                self.response['error'].append(blog_settings_error)
-                self.config['POSTS_COLLECTION'].drop()
-                self.config['USERS_COLLECTION'].drop()
-                self.collection.drop()
-            return self.response
+                response['error'] = []
+                response['error'].append(user_create['error'])
+                response['error'].append(post_create['error'])
+                response['error'].append(blog_settings_error)
+                self.uninstall()
+            else:
+                self.installed = True
+            return response
 
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Installation error..'
+            response['error'] = 'Installation error..'
 
     def update_settings(self, data):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
             cursor = self.collection.find_one()
             self.collection.update(
                 {'_id': cursor['_id']}, {'$set': data}, upsert=False, multi=False)
-            self.response['data'] = True
-            return self.response
+            self.invalidate_cache()
+            self.generation.bump()
+            response['data'] = True
+            return response
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Settings update error..'
+            response['error'] = 'Settings update error..'
 
     @staticmethod
     def print_debug_info(msg, show=False):
@@ -0,0 +1,198 @@
+import html
+import json
+import uuid
+from pymongo import ReplaceOne
+
+
+# Namespace of the deterministic STIX identifiers derived from post ids
+STIX_NAMESPACE = uuid.UUID('5c3a8f2e-4b8d-4a8e-9f39-3d2b6f1c7a10')
+
+SPEC_VERSION = '2.1'
+
+# Fields read to build the STIX objects of a post
+POST_FIELDS = ['incident_title', 'incident_description',
+               'ttp_resource_infrastructure', 'incident_categories',
+               'ttp_description', 'ttp_exploits_targets',
+               'incident_time_initial_compromise',
+               'incident_time_incident_reported',
+               'loss_crypto', 'loss_usd', 'description_geographical',
+               'references', 'permalink', 'date', 'modified']
+
+
+def stix_id(object_type, *parts):
+    return '%s--%s' % (object_type, uuid.uuid5(
+        STIX_NAMESPACE, ':'.join([object_type] + [str(part) for part in parts])))
+
+
+def stix_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)
+
+
+def text(value):
+    return html.unescape(value) if value else value
+
+
+def last_modified(post):
+    return post.get('modified') or post.get('date')
+
+
+class StixExporter:
+    """
+    Exports incidents as STIX 2.1 bundles.
+
+    Every post becomes an incident object, plus an attack-pattern for its
+    TTP description/exploit targets and an infrastructure object for its
+    resources, linked to the incident by relationships. The serialized
+    objects of each post are cached in STIX_COLLECTION along with the
+    post's last modified time, so a database export only builds and
+    serializes the posts that changed since the previous one.
+    """
+
+    def __init__(self, default_config):
+        self.collection = default_config['POSTS_COLLECTION']
+        self.cache_collection = default_config['STIX_COLLECTION']
+        self.batch_size = default_config.get('EXPORT_BATCH_SIZE', 500)
+
+    @staticmethod
+    def make_objects(post):
+        """
+        Maps a post onto a list of STIX objects.
+        """
+        created = stix_time(post['date'])
+        modified = stix_time(last_modified(post))
+        common = {'spec_version': SPEC_VERSION,
+                  'created': created,
+                  'modified': modified}
+
+        incident = dict(common, type='incident',
+                        id=stix_id('incident', post['_id']),
+                        name=text(post.get('incident_title')) or 'Untitled')
+        if post.get('incident_description'):
+            incident['description'] = text(post['incident_description'])
+        if post.get('incident_categories'):
+            incident['labels'] = [text(post['incident_categories'])]
+        if post.get('references'):
+            references = []
+            for reference in text(post['references']).split():
+                if '://' in reference:
+                    references.append({'source_name': 'reference', 'url': reference})
+                else:
+                    references.append({'source_name': 'reference', 'description': reference})
+            incident['external_references'] = references
+        for field in ('incident_time_initial_compromise',
+                      'incident_time_incident_reported'):
+            if post.get(field):
+                incident['x_' + field] = stix_time(post[field])
+        for field in ('loss_crypto', 'loss_usd', 'description_geographical',
+                      'permalink'):
+            if post.get(field):
+                incident['x_' + field] = text(post[field])
+        objects = [incident]
+
+        if post.get('ttp_description') or post.get('ttp_exploits_targets'):
+            attack_pattern = dict(common, type='attack-pattern',
+                                  id=stix_id('attack-pattern', post['_id']),
+                                  name=text(post.get('ttp_description')) or 'Unknown')
+            if post.get('ttp_exploits_targets'):
+                attack_pattern['x_exploits_targets'] = text(post['ttp_exploits_targets'])
+            objects.append(attack_pattern)
+
+        if post.get('ttp_resource_infrastructure'):
+            objects.append(dict(common, type='infrastructure',
+                                id=stix_id('infrastructure', post['_id']),
+                                name=text(post['ttp_resource_infrastructure'])))
+
+        for target in objects[1:]:
+            objects.append(dict(common, type='relationship',
+                                id=stix_id('relationship', post['_id'], target['type']),
+                                relationship_type='related-to',
+                                source_ref=incident['id'],
+                                target_ref=target['id']))
+        return objects
+
+    def serialize_posts(self, post_ids):
+        """
+        Builds and caches the serialized objects of post_ids, returning the
+        serialized fragments.
+        """
+        fragments = []
+        requests = []
+        cursor = self.collection.find({'_id': {'$in': post_ids}},
+                                      dict.fromkeys(POST_FIELDS, 1))
+        for post in cursor:
+            fragment = ','.join(json.dumps(obj, sort_keys=True)
+                                for obj in self.make_objects(post))
+            fragments.append(fragment)
+            requests.append(ReplaceOne(
+                {'_id': post['_id']},
+                {'modified': last_modified(post), 'objects': fragment},
+                upsert=True))
+        if requests:
+            self.cache_collection.bulk_write(requests, ordered=False)
+        return fragments
+
+    def iter_fragments(self):
+        """
+        Yields the serialized objects of every post, from the cache when
+        the post has not been modified since it was cached.
+
+        Posts and cache entries are both walked in _id order and merged,
+        only the ids and modified times of unchanged posts are read.
+        """
+        cached = self.cache_collection.find().sort('_id', 1).batch_size(self.batch_size)
+        entry = next(cached, None)
+        stale = []
+        pending = []
+        posts = self.collection.find({}, {'date': 1, 'modified': 1}) \
+            .sort('_id', 1).batch_size(self.batch_size)
+        for post in posts:
+            while entry is not None and entry['_id'] < post['_id']:
+                # cached post that has been deleted since
+                stale.append(entry['_id'])
+                entry = next(cached, None)
+            if entry is not None and entry['_id'] == post['_id']:
+                current, entry = entry, next(cached, None)
+                if current['modified'] == last_modified(post):
+                    yield current['objects']
+                    continue
+            pending.append(post['_id'])
+            if len(pending) >= self.batch_size:
+                for fragment in self.serialize_posts(pending):
+                    yield fragment
+                pending = []
+        if pending:
+            for fragment in self.serialize_posts(pending):
+                yield fragment
+
+        while entry is not None:
+            stale.append(entry['_id'])
+            entry = next(cached, None)
+        if stale:
+            self.cache_collection.delete_many({'_id': {'$in': stale}})
+
+    def iter_bundle(self, fragments=None):
+        """
+        Yields a STIX bundle of all posts, or of the given serialized
+        fragments, piece by piece.
+        """
+        if fragments is None:
+            fragments = self.iter_fragments()
+        yield '{"id": "bundle--%s", "objects": [' % uuid.uuid4()
+        first = True
+        for fragment in fragments:
+            if not fragment:
+                continue
+            yield fragment if first else ',' + fragment
+            first = False
+        yield '], "type": "bundle"}'
+
+    def get_bundle(self, post):
+        """
+        Returns the STIX bundle of a single post as a string.
+        """
+        entry = self.cache_collection.find_one({'_id': post['_id']})
+        if entry is not None and entry['modified'] == last_modified(post):
+            fragments = [entry['objects']]
+        else:
+            fragments = self.serialize_posts([post['_id']])
+        return ''.join(self.iter_bundle(fragments))
@@ -0,0 +1,181 @@
+import re
+import math
+import html
+from pymongo import ReturnDocument
+
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he in is it its of on or
+that the their there this to was were will with which who not no we you
+""".split())
+
+# Suffixes stripped by stem(), longest first
+SUFFIXES = ('ational', 'fulness', 'iveness', 'ization', 'ousness',
+            'ations', 'ation', 'ement', 'ments', 'ness', 'ment', 'ings',
+            'ing', 'edly', 'ies', 'ied', 'ers', 'est', 'ed', 'er', 'ly',
+            'es', 's')
+
+
+def stem(word):
+    """
+    Light suffix stripping stemmer, enough to conflate the usual English
+    inflections ('attacks', 'attacked', 'attacking' -> 'attack').
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == 'es' and not word[:-2].endswith(('s', 'x', 'z', 'ch', 'sh')):
+                continue
+            word = word[:-len(suffix)]
+            if suffix in ('ies', 'ied'):
+                word += 'y'
+            break
+    # 'exchange' and 'exchanges' -> 'exchang'
+    if len(word) > 4 and word.endswith('e'):
+        word = word[:-1]
+    # 'hacked' -> 'hack', 'stopped' -> 'stop'
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+        word = word[:-1]
+    return word
+
+
+def analyze(text):
+    """
+    Splits text into a list of lowercased, stemmed terms without stopwords.
+    """
+    if not text:
+        return []
+    text = html.unescape(text).lower()
+    return [stem(token) for token in TOKEN_RE.findall(text)
+            if token not in STOPWORDS]
+
+
+class SearchIndex:
+    """
+    Inverted index over incident titles and descriptions ranked with BM25.
+
+    Each indexed post has one document in SEARCH_COLLECTION holding its
+    distinct terms (multikey indexed), term frequencies and length. A
+    single 'stats' document keeps the document count and total length
+    used for BM25 length normalisation.
+    """
+
+    STATS_ID = 'stats'
+    TITLE_WEIGHT = 2
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, default_config):
+        self.collection = default_config['SEARCH_COLLECTION']
+
+    def make_entry(self, post):
+        terms = analyze(post.get('incident_title')) * self.TITLE_WEIGHT + \
+            analyze(post.get('incident_description'))
+        tf = {}
+        for term in terms:
+            tf[term] = tf.get(term, 0) + 1
+        return {'terms': list(tf), 'tf': tf, 'length': len(terms),
+                'date': post.get('date')}
+
+    def index_post(self, post_id, post):
+        entry = self.make_entry(post)
+        old = self.collection.find_one_and_replace(
+            {'_id': post_id}, entry, upsert=True,
+            return_document=ReturnDocument.BEFORE)
+        docs, length = 1, entry['length']
+        if old:
+            docs, length = 0, length - old['length']
+        self.update_stats(docs, length)
+
+    def index_new_posts(self, posts):
+        """
+        Indexes posts that are not in the index yet with one insert.
+        """
+        entries = []
+        length = 0
+        for post in posts:
+            entry = self.make_entry(post)
+            entry['_id'] = post['_id']
+            entries.append(entry)
+            length += entry['length']
+        if entries:
+            self.collection.insert_many(entries, ordered=False)
+            self.update_stats(len(entries), length)
+
+    def remove_post(self, post_id):
+        old = self.collection.find_one_and_delete(
+            {'_id': post_id}, projection={'length': 1})
+        if old:
+            self.update_stats(-1, -old['length'])
+
+    def update_stats(self, docs, length):
+        self.collection.update_one(
+            {'_id': self.STATS_ID},
+            {'$inc': {'docs': docs, 'length': length}}, upsert=True)
+
+    def rebuild(self, posts_collection, batch_size=500):
+        """
+        Rebuilds the whole index from posts_collection.
+        """
+        self.collection.drop()
+        self.collection.create_index('terms')
+        batch = []
+        docs = length = 0
+        fields = {'incident_title': 1, 'incident_description': 1, 'date': 1}
+        for post in posts_collection.find({}, fields).batch_size(batch_size):
+            entry = self.make_entry(post)
+            entry['_id'] = post['_id']
+            batch.append(entry)
+            docs += 1
+            length += entry['length']
+            if len(batch) >= batch_size:
+                self.collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            self.collection.insert_many(batch, ordered=False)
+        self.collection.insert_one(
+            {'_id': self.STATS_ID, 'docs': docs, 'length': length})
+        return docs
+
+    def search(self, query, limit, skip):
+        """
+        Returns (post_ids, total) for a page of posts matching any query
+        term, best BM25 score first and newest first on ties.
+
+        total comes from the same candidate scan that is ranked, so no
+        second query is needed to paginate.
+        """
+        terms = list(set(analyze(query)))
+        if not terms:
+            return [], 0
+
+        stats = self.collection.find_one({'_id': self.STATS_ID}) or {}
+        docs = max(stats.get('docs', 0), 1)
+        avg_length = float(stats.get('length', 0)) / docs or 1.0
+
+        projection = dict(('tf.' + term, 1) for term in terms)
+        projection['length'] = 1
+        projection['date'] = 1
+        candidates = list(self.collection.find(
+            {'terms': {'$in': terms}}, projection))
+
+        df = dict.fromkeys(terms, 0)
+        for candidate in candidates:
+            for term in candidate['tf']:
+                df[term] += 1
+
+        scored = []
+        for candidate in candidates:
+            score = 0.0
+            norm = self.K1 * (1 - self.B + self.B * candidate['length'] / avg_length)
+            for term, freq in candidate['tf'].items():
+                idf = math.log(1 + (docs - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * freq * (self.K1 + 1) / (freq + norm)
+            scored.append((score, candidate.get('date'), candidate['_id']))
+
+        scored.sort(key=lambda item: (item[0], item[1] is not None, item[1]),
+                    reverse=True)
+        return [item[2] for item in scored[skip:skip + limit]], len(scored)
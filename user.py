@@ -10,35 +10,30 @@ class User:
 
     def __init__(self, default_config):
         self.collection = default_config['USERS_COLLECTION']
-        self.username = None
-        self.email = None
-        self.super = None
         self.session_key = 'user'
-        self.response = {'error': None, 'data': None}
         self.debug_mode = default_config['DEBUG']
 
     def login(self, username, password):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
+        user = {'username': None, 'email': None, 'super': None}
         try:
             user_session = self.collection.find_one({'_id': username})
             if user_session:
                 if self.validate_login(user_session['password'], password):
-                    self.username = user_session['_id']
-                    self.email = user_session['email']
-                    self.super = user_session['super']
+                    user = {'username': user_session['_id'],
+                            'email': user_session['email'],
+                            'super': user_session['super']}
                 else:
-                    self.response['error'] = 'User or Password invalid..'
+                    response['error'] = 'User or Password invalid..'
             else:
-                self.response['error'] = 'User or Password invalid..'
+                response['error'] = 'User or Password invalid..'
 
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'System error..'
+            response['error'] = 'System error..'
 
-        self.response['data'] = {'username': self.username,
-                                 'email': self.email,
-                                 'super': self.super}
-        return self.response
+        response['data'] = user
+        return response
 
 
     @staticmethod
@@ -59,33 +54,33 @@ class User:
 
 
     def get_users(self):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
             users = self.collection.find().sort('date', direction=-1)
-            self.response['data'] = []
+            response['data'] = []
             for user in users:
                 print(user)
-                self.response['data'].append({'id': user['_id'],
-                                              'super': user['super'],
-                                              'email': user['email'],
-                                              'date': user['date']})
+                response['data'].append({'id': user['_id'],
+                                         'super': user['super'],
+                                         'email': user['email'],
+                                         'date': user['date']})
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Users not found..'
-        return self.response
+            response['error'] = 'Users not found..'
+        return response
 
 
     def get_user(self, user_id):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
             user = self.collection.find_one({'_id': user_id})
             gravatar_url = self.get_gravatar_link(user.get('email', ''))
-            self.response['data'] = user
-            self.response['data']['gravatar_url'] = gravatar_url
+            response['data'] = user
+            response['data']['gravatar_url'] = gravatar_url
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'User not found..'
-        return self.response
+            response['error'] = 'User not found..'
+        return response
 
 
     @staticmethod
@@ -97,22 +92,22 @@ class User:
 
 
     def delete_user(self, user_id):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         try:
             self.collection.remove({'_id': user_id})
-            self.response['data'] = True
+            response['data'] = True
         except Exception as e:
             self.print_debug_info(e, self.debug_mode)
-            self.response['error'] = 'Delete user error..'
-        return self.response
+            response['error'] = 'Delete user error..'
+        return response
 
 
     def save_user(self, user_data):
-        self.response['error'] = None
+        response = {'error': None, 'data': None}
         if user_data:
             if not re.match(r"^[A-Za-z0-9\.\+_-]+@[A-Za-z0-9\._-]+\.[a-zA-Z]*$", user_data['email']):
-                self.response['error'] = 'Email is invalid..'
-                return self.response
+                response['error'] = 'Email is invalid..'
+                return response
 
             exist_user = self.collection.find_one({'_id': user_data['_id']})
             if user_data['update'] is not False:
@@ -131,20 +126,20 @@ class User:
                                         {'$set': record},
                                         upsert=False,
                                         multi=False)
-                                    self.response['data'] = True
+                                    response['data'] = True
 
                                 except Exception as e:
                                     self.print_debug_info(e, self.debug_mode)
-                                    self.response[
+                                    response[
                                         'error'] = 'Update user error..'
                             else:
-                                self.response[
+                                response[
                                     'error'] = 'New password doesn\'t match..'
-                                return self.response
+                                return response
                         else:
-                            self.response[
+                            response[
                                 'error'] = 'Old password doesn\'t match..'
-                            return self.response
+                            return response
                     else:
                         try:
                             self.collection.update(
@@ -153,18 +148,18 @@ class User:
                                           'super': user_data['super']}
                                 },
                                  upsert=False, multi=False)
-                            self.response['data'] = True
+                            response['data'] = True
 
                         except Exception as e:
                             self.print_debug_info(e, self.debug_mode)
-                            self.response['error'] = 'Update user error..'
+                            response['error'] = 'Update user error..'
                 else:
-                    self.response['error'] = 'User not found..'
-                    return self.response
+                    response['error'] = 'User not found..'
+                    return response
             else:
                 if exist_user:
-                    self.response['error'] = 'Username already exists..'
-                    return self.response
+                    response['error'] = 'Username already exists..'
+                    return response
                 else:
                     if user_data['new_pass'] and\
                        user_data['new_pass'] == user_data['new_pass_again']:
@@ -180,19 +175,19 @@ class User:
 
                         try:
                             self.collection.insert(record)
-                            self.response['data'] = True
+                            response['data'] = True
 
                         except Exception as e:
                             self.print_debug_info(e, self.debug_mode)
-                            self.response['error'] = 'Create user error..'
+                            response['error'] = 'Create user error..'
 
                     else:
-                        self.response[
+                        response[
                             'error'] = 'Password cannot be blank and must be the same..'
-                        return self.response
+                        return response
         else:
-            self.response['error'] = 'Error..'
-        return self.response
+            response['error'] = 'Error..'
+        return response
 
 
     @staticmethod
@@ -1,54 +1,126 @@
 import cgi
+import datetime
+import html
 import os
-from flask import Flask, render_template, abort, url_for, request, flash, session, redirect
-from flaskext.markdown import Markdown
-from mdx_github_gists import GitHubGistExtension
-from mdx_strike import StrikeExtension
-from mdx_quote import QuoteExtension
-from mdx_code_multiline import MultilineCodeExtension
+from flask import Flask, render_template, abort, url_for, request, flash, session, redirect, Response, g
 from werkzeug.contrib.atom import AtomFeed
 import post
 import user
 import pagination
 import settings
+import markdown_render
+import importer
+import exporter
+import stix
+import migrations
+import api
+import page_cache
+import database
+import instrumentation
+import metrics
 from helper_functions import *
-import csv
+import click
 
 
 app = Flask('IncidentDB')
-md = Markdown(app)
-md.register_extension(GitHubGistExtension)
-md.register_extension(StrikeExtension)
-md.register_extension(QuoteExtension)
-md.register_extension(MultilineCodeExtension)
 app.config.from_object('config')
+instrumentation.install(app.config).observers.append(metrics.observe_operation)
+
+
+# Registered first so the queries of the other request hooks are recorded
+# and the timing header is added after every other after_request hook
+@app.before_request
+def start_instrumentation():
+    g.in_progress = True
+    metrics.request_started(request.endpoint)
+    instrumentation.start_request(method=request.method, path=request.path,
+                                  endpoint=request.endpoint)
+
+
+@app.after_request
+def add_server_timing(response):
+    recorder = instrumentation.end_request()
+    if recorder is None:
+        return response
+    metrics.observe_request(request.endpoint, request.method,
+                            response.status_code, recorder.elapsed_ms / 1000.0)
+    if app.config['SERVER_TIMING'] and may_see_server_timing():
+        response.headers['Server-Timing'] = recorder.server_timing()
+    return response
+
+
+def may_see_server_timing():
+    # The header names collections and commands, so only for the metrics
+    # addresses and administrators
+    if request.remote_addr in app.config['METRICS_ALLOWED_ADDRS']:
+        return True
+    user = session.get('user')
+    return bool(user and user.get('super'))
+
+
+@app.teardown_request
+def end_instrumentation(exception=None):
+    if g.pop('in_progress', False):
+        metrics.request_ended(request.endpoint)
+
+
+def list_posts(page, tag=None, search=None, filters=None):
+    """
+    Fetches a listing page, by keyset cursor when the request carries one
+    and by page number otherwise.
+    """
+    after, before = get_page_cursor()
+    per_page = int(app.config['PER_PAGE'])
+    skip = (page - 1) * per_page
+    posts = postClass.get_posts(per_page, skip, tag=tag, search=search,
+                                after=after, before=before, shape='card',
+                                filters=filters)
+    count = posts['count']
+    count_cap = None
+    if count is None:
+        count = postClass.get_total_count(tag=tag, search=search, filters=filters)
+        if tag is not None or search is not None or filters:
+            count_cap = app.config.get('COUNT_CAP')
+    pag = pagination.Pagination(page, per_page, count,
+                                next_cursor=posts['next_cursor'],
+                                prev_cursor=posts['prev_cursor'],
+                                cursor_mode=after is not None or before is not None,
+                                count_cap=count_cap)
+    return posts, pag
 
 
 @app.route('/', defaults={'page': 1})
 @app.route('/page-<int:page>')
 def index(page):
-    skip = (page - 1) * int(app.config['PER_PAGE'])
-    posts = postClass.get_posts(int(app.config['PER_PAGE']), skip)
-    count = postClass.get_total_count()
-    pag = pagination.Pagination(page, app.config['PER_PAGE'], count)
+    posts, pag = list_posts(page)
     return render_template('index.html', posts=posts['data'], pagination=pag, meta_title=app.config['BLOG_TITLE'])
 
 @app.route('/analytics')
 def analytics():
-    return render_template('analytics.html')
+    return render_template('analytics.html',
+                           rollups=postClass.analytics.get_rollups(),
+                           top_losses=postClass.get_top_losses(),
+                           meta_title='Analytics')
 
 @app.route('/tag/<tag>', defaults={'page': 1})
 @app.route('/tag/<tag>/page-<int:page>')
 def posts_by_tag(tag, page):
-    skip = (page - 1) * int(app.config['PER_PAGE'])
-    posts = postClass.get_posts(int(app.config['PER_PAGE']), skip, tag=tag)
-    count = postClass.get_total_count(tag=tag)
+    posts, pag = list_posts(page, tag=tag)
     if not posts['data']:
         abort(404)
-    pag = pagination.Pagination(page, app.config['PER_PAGE'], count)
     return render_template('index.html', posts=posts['data'], pagination=pag, meta_title='Posts by tag: ' + tag)
 
 
+@app.route('/browse', defaults={'page': 1})
+@app.route('/browse/page-<int:page>')
+def browse(page):
+    filters = get_facet_filters()
+    posts, pag = list_posts(page, filters=filters)
+    return render_template('index.html', posts=posts['data'], pagination=pag,
+                           facets=postClass.get_facets(filters),
+                           meta_title='Browse incidents')
+
+
 @app.route('/incident/<permalink>')
 def single_post(permalink):
     post = postClass.get_post_by_permalink(permalink)
@@ -62,24 +134,15 @@ def single_post(permalink):
 @app.route('/q/<query>', defaults={'page': 1})
 @app.route('/q/<query>/page-<int:page>')
 def search_results(page, query):
-    skip = (page - 1) * int(app.config['PER_PAGE'])
-    if query:
-        posts = postClass.get_posts(
-            int(app.config['PER_PAGE']), skip, search=query)
-    else:
-        posts = []
-        posts['data'] = []
-    count = postClass.get_total_count(search=query)
-    pag = pagination.Pagination(page, app.config['PER_PAGE'], count)
+    posts, pag = list_posts(page, search=query)
     return render_template('index.html', posts=posts['data'], pagination=pag, meta_title='Search results')
 
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
-    if request.method != 'POST':
-        return redirect(url_for('index'))
-
-    query = request.form.get('query', None)
+    # The nav form submits by GET, pages embedding it are shared through
+    # the page cache and carry no per-visitor CSRF token
+    query = request.values.get('query', None)
     if query:
         return redirect(url_for('search_results', query=query))
     else:
@@ -105,10 +168,10 @@ def new_post():
         else:
             # Sanitize data
             try:
-                ttp_resources_infrastructure = \
+                ttp_resource_infrastructure = \
                     request.form.get('ttp-resources-infrastructure').strip()
             except:
-                ttp_resources_infrastructure = None
+                ttp_resource_infrastructure = None
 
             try:
                 incident_categories = \
@@ -147,7 +210,7 @@ def new_post():
                 loss_usd = None
 
             try:
-                geographical = request.form.get('description-geographical').strip(),
+                geographical = request.form.get('description-geographical').strip()
             except:
                 geographical = None
 
@@ -234,10 +297,7 @@ def post_preview():
 @login_required()
 def posts(page):
     session.pop('post-preview', None)
-    skip = (page - 1) * int(app.config['PER_PAGE'])
-    posts = postClass.get_posts(int(app.config['PER_PAGE']), skip)
-    count = postClass.get_total_count()
-    pag = pagination.Pagination(page, app.config['PER_PAGE'], count)
+    posts, pag = list_posts(page)
 
     if not posts['data']:
         abort(404)
@@ -384,20 +444,223 @@ def save_user():
     return redirect(url_for('edit_user', id=post_data['_id']))
 
 
-@app.route('/recent_feed')
-def recent_feed():
-    feed = AtomFeed('TNO Blockchain Incident Database::Recent Incidents',
-                    feed_url=request.url, url=request.url_root)
-    posts = postClass.get_posts(int(app.config['PER_PAGE']), 0)
+def build_feed(title, tag=None, filters=None):
+    """
+    Renders the Atom feed of the latest incidents from their stored HTML.
+    """
+    posts = postClass.get_posts(int(app.config['PER_PAGE']), 0, tag=tag,
+                                filters=filters, shape='feed')
+    if posts['error']:
+        abort(500)
+    updated = max([post['modified'] or post['date'] for post in posts['data']] or
+                  [datetime.datetime.utcnow()])
+    feed = AtomFeed(title, feed_url=request.url, url=request.url_root,
+                    updated=updated)
     for post in posts['data']:
-        post_entry = post['incident_short_description'] if\
-            post['incident_short_description'] else post['incident_description']
-        feed.add(post['incident_title'], md(post_entry),
+        url = make_external(url_for('single_post', permalink=post['permalink']))
+        feed.add(html.unescape(post['incident_title']),
+                 str(markdown_render.rendered(post, 'incident_description')),
                  content_type='html',
-                 url=make_external(
-                     url_for('single_post', permalink=post['permalink'])),
-                 updated=post['date'])
-    return feed.get_response()
+                 summary=str(markdown_render.rendered(post, 'incident_preview')),
+                 summary_type='html',
+                 author=post['author'], url=url, id=url,
+                 updated=post['modified'] or post['date'],
+                 published=post['date'])
+    response = Response(feed.to_string(), mimetype='application/atom+xml')
+    response.add_etag()
+    response.last_modified = updated
+    return response
+
+
+def feed_response(title, tag=None, filters=None):
+    """
+    Serves a feed from the feed cache, which holds the XML of every feed
+    URL until the next content generation, answering conditional requests
+    with 304.
+    """
+    try:
+        key = feedCache.key(request.url)
+    except Exception as e:
+        postClass.print_debug_info(e, app.config['DEBUG'])
+        key = None
+    page = feedCache.get(key) if key is not None else None
+    if page is not None:
+        status, headers, body = page
+        response = Response(body, status=status, headers=headers)
+    elif key is not None:
+        # Stored under the current generation, so built from the primary
+        with database.reading_from(None):
+            response = build_feed(title, tag, filters)
+        feedCache.set(key, response)
+    else:
+        response = build_feed(title, tag, filters)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['PAGE_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@app.route('/recent_feed')
+def recent_feed():
+    return feed_response(app.config['BLOG_TITLE'] + '::Recent Incidents')
+
+
+@app.route('/recent_feed/tag/<tag>')
+def tag_feed(tag):
+    return feed_response(app.config['BLOG_TITLE'] + '::Incidents tagged ' + tag,
+                         tag=tag)
+
+
+@app.route('/recent_feed/category/<category>')
+def category_feed(category):
+    return feed_response(app.config['BLOG_TITLE'] + '::Incidents in ' +
+                         html.unescape(category),
+                         filters={'category': category})
+
+
+def api_response(etag, build):
+    """
+    Answers a conditional API request: 304 when the client already has
+    etag, otherwise the JSON of build(), which returns (etag, data) for
+    the data it actually read.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        etag, data = build()
+        response = Response(api.dumps(data), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def api_error(status, message):
+    return Response(api.dumps({'error': message}), status=status,
+                    mimetype='application/json')
+
+
+def api_limit():
+    try:
+        limit = int(request.args.get('limit', app.config['PER_PAGE']))
+    except ValueError:
+        abort(400)
+    return max(1, min(limit, api.MAX_LIMIT))
+
+
+@app.route('/api/v1/incidents')
+def api_incidents():
+    """
+    Lists incidents newest first by cursor (?after=/?before= tokens from
+    the previous page), optionally by tag and the /browse facet filters.
+    """
+    limit = api_limit()
+    after, before = get_page_cursor()
+    tag = request.args.get('tag')
+    filters = get_facet_filters()
+
+    def page(shape):
+        posts = postClass.get_posts(limit, 0, tag=tag, after=after, before=before,
+                                    shape=shape, filters=filters)
+        if posts['error']:
+            abort(500)
+        return {'data': posts['data'], 'next_cursor': posts['next_cursor'],
+                'prev_cursor': posts['prev_cursor']}
+
+    def build():
+        data = page('api')
+        etag = api.posts_etag(data['data'], data['next_cursor'], data['prev_cursor'])
+        data['data'] = [api.serialize_post(post) for post in data['data']]
+        return etag, data
+
+    versions = page('version')
+    return api_response(api.posts_etag(versions['data'], versions['next_cursor'],
+                                       versions['prev_cursor']), build)
+
+
+@app.route('/api/v1/incidents/<permalink>')
+def api_incident(permalink):
+    post = postClass.get_post_by_permalink(permalink)['data']
+    if not post:
+        return api_error(404, 'Incident not found..')
+    etag = api.make_etag(post['_id'], api.post_version(post))
+    return api_response(etag, lambda: (etag, {'data': api.serialize_post(post)}))
+
+
+@app.route('/api/v1/tags')
+def api_tags():
+    tags = postClass.get_top_tags()
+    data = {'data': tags}
+    etag = api.make_etag(api.dumps(data))
+    return api_response(etag, lambda: (etag, data))
+
+
+@app.route('/api/v1/search')
+def api_search():
+    """
+    Ranks incidents matching ?q=, by ?page= since ranked results have no
+    cursor order.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return api_error(400, 'Missing q parameter..')
+    limit = api_limit()
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        abort(400)
+
+    # Ranked once, the API fields are only read when the ETag doesn't match
+    versions = postClass.get_posts(limit, (page - 1) * limit, search=query,
+                                   shape='version')
+    if versions['error']:
+        abort(500)
+    count = versions['count']
+    if count is None:
+        count = postClass.get_total_count(search=query)
+    ids = [post['id'] for post in versions['data']]
+
+    def build():
+        posts = postClass.get_posts_by_ids(ids, shape='api')
+        if posts['error']:
+            abort(500)
+        etag = api.posts_etag(posts['data'], query, page, count)
+        return etag, {'data': [api.serialize_post(post) for post in posts['data']],
+                      'count': count, 'page': page}
+
+    return api_response(api.posts_etag(versions['data'], query, page, count), build)
+
+
+# Export formats: file extension -> (exporter class, generator method, mimetype)
+EXPORT_FORMATS = {'csv': (exporter.Exporter, 'iter_csv', 'text/csv'),
+                  'jsonl': (exporter.Exporter, 'iter_jsonl', 'application/x-ndjson'),
+                  'stix.json': (stix.StixExporter, 'iter_bundle', 'application/stix+json')}
+
+
+def export_chunks(fmt):
+    exporter_class, method, mimetype = EXPORT_FORMATS[fmt]
+    return getattr(exporter_class(app.config), method)()
+
+
+@app.route('/export/incidents.<fmt>')
+@login_required()
+def export_incidents(fmt):
+    """
+    Streams the whole database, a full collection scan per request, so
+    only to logged in users. Each incident is also public on its own page
+    and at /incident/<permalink>/stix.json.
+    """
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    return Response(export_chunks(fmt), mimetype=EXPORT_FORMATS[fmt][2], headers={
+        'Content-Disposition': 'attachment; filename=incidents.' + fmt})
+
+
+@app.route('/incident/<permalink>/stix.json')
+def single_post_stix(permalink):
+    post = postClass.get_post_by_permalink(permalink)
+    if not post['data']:
+        abort(404)
+    bundle = stix.StixExporter(app.config).get_bundle(post['data'])
+    return Response(bundle, mimetype='application/stix+json')
 
 
 @app.route('/settings', methods=['GET', 'POST'])
@@ -476,44 +739,6 @@ def install():
         else:
             install_result = settingsClass.install(blog_data, user_data)
 
-            # install existing csv files
-            # Settle file upload
-            f = request.files['file-upload'].read()
-
-            # Decode f take as utf-8
-            f = f.decode('utf-8')
-
-            # Split lines 
-            f = f.splitlines()
-
-            # Read the file
-            csvreader = csv.reader(f, delimiter =',')
-
-            # skip header
-            next(csvreader)
-
-            # upload data to database
-            for lines in csvreader:
-                post_data = {'incident_title': lines[0],
-                             'incident_time_initial_compromise': lines[1],
-                             'incident_time_incident_reported': lines[2],
-                             'incident_description': lines[3],
-                             'ttp_resources_infrastructure': lines[4],
-                             'incident_categories' : lines[5],
-                             'ttp_description': lines[6],
-                             'ttp_exploits_targets': lines[7],
-                             'loss_crypto': lines[8],
-                             'loss_usd': lines[9],
-                             'description_geographical': lines[10],
-                             'references': lines[11],
-                             'advanced': None,
-                             'author': user_data['_id']}
-
-                post = postClass.validate_post_data(post_data)
-                post_create = postClass.create_new_post(post)
-
-
-
             if install_result['error']:
                 for i in install_result['error']:
                     if i is not None:
@@ -521,6 +746,14 @@ def install():
             else:
                 session['installed'] = True
                 flash('Successfully installed!', 'success')
+
+                # install existing csv files
+                upload = request.files.get('file-upload')
+                if upload and upload.filename:
+                    report = importer.CsvImporter(postClass).run(
+                        upload.stream, user_data['_id'])
+                    flash_import_report(report)
+
                 user_login = userClass.login(
                     user_data['_id'], user_data['new_pass'])
                 if user_login['error']:
@@ -540,6 +773,14 @@ def install():
                            meta_title='Install')
 
 
+def flash_import_report(report, max_errors=10):
+    flash('Imported %d incidents.' % report['imported'], 'success')
+    for error in report['errors'][:max_errors]:
+        flash('Row %d: %s' % (error['row'], error['error']), 'error')
+    if len(report['errors']) > max_errors:
+        flash('%d more rows failed..' % (len(report['errors']) - max_errors), 'error')
+
+
 @app.before_request
 def csrf_protect():
     if request.method == "POST":
@@ -550,19 +791,95 @@ def csrf_protect():
 
 @app.before_request
 def is_installed():
-    app.config = settingsClass.get_config()
-    app.jinja_env.globals['meta_description'] = app.config['BLOG_DESCRIPTION']
+    config = settingsClass.get_config()
+    app.jinja_env.globals['meta_description'] = config['BLOG_DESCRIPTION']
     if not settingsClass.is_installed():
         session['installed'] = False
-        if url_for('static', filename='') not in request.path and request.path != url_for('install'):
+        if url_for('static', filename='') not in request.path and \
+           request.path not in (url_for('install'), url_for('prometheus_metrics')):
             return redirect(url_for('install'))
 
 
+# Public pages that only depend on the database, served from the page
+# cache to anonymous visitors
+PAGE_CACHE_ENDPOINTS = frozenset(['index', 'browse', 'analytics', 'posts_by_tag',
+                                  'single_post', 'search_results'])
+
+
+def is_public_page():
+    return request.method == 'GET' and request.endpoint in PAGE_CACHE_ENDPOINTS
+
+
+@app.before_request
+def serve_cached_page():
+    g.page_cache_key = None
+    if not pageCache.enabled or not is_public_page() or session.get('user'):
+        return
+    try:
+        key = pageCache.key(request.url)
+    except Exception as e:
+        postClass.print_debug_info(e, app.config['DEBUG'])
+        return
+    page = pageCache.get(key)
+    if page is None:
+        g.page_cache_key = key
+        return
+    status, headers, body = page
+    return Response(body, status=status, headers=headers)
+
+
+@app.after_request
+def store_cached_page(response):
+    if not is_public_page():
+        return response
+    if session.get('user'):
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    if g.get('page_cache_key') is not None and response.status_code == 200 \
+       and not response.is_streamed:
+        pageCache.set(g.page_cache_key, response)
+    if response.status_code == 200:
+        # A response that sets the session cookie must not be shared
+        if session.modified:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        response.cache_control.max_age = app.config['PAGE_CACHE_MAX_AGE']
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+# Routes that only read, they may be served by replica set secondaries
+READ_ONLY_ENDPOINTS = PAGE_CACHE_ENDPOINTS | frozenset([
+    'recent_feed', 'tag_feed', 'category_feed', 'export_incidents',
+    'single_post_stix', 'api_incidents', 'api_incident', 'api_tags', 'api_search'])
+
+
 @app.before_request
-def set_globals():
-    app.jinja_env.globals['csrf_token'] = generate_csrf_token
-    app.jinja_env.globals['recent_posts'] = postClass.get_posts(10, 0)['data']
-    app.jinja_env.globals['tags'] = postClass.get_tags()['data']
+def use_read_preference():
+    # A page that will be stored in the page cache is read from the
+    # primary, a lagging secondary would file old content under the
+    # current generation until the next write
+    if g.get('page_cache_key') is not None:
+        return
+    if readPreference is not None and request.method == 'GET' and \
+       request.endpoint in READ_ONLY_ENDPOINTS:
+        database.set_read_preference(readPreference)
+
+
+@app.teardown_request
+def reset_read_preference(exception=None):
+    database.set_read_preference(None)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if request.remote_addr not in app.config['METRICS_ALLOWED_ADDRS']:
+        abort(404)
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
 
 
 @app.errorhandler(404)
@@ -575,11 +892,103 @@ def format_datetime_filter(input_value, format_="%Y %m %d"):
     return input_value.strftime(format_)
 
 
+@app.template_filter('rendered')
+def rendered_filter(post, field):
+    return markdown_render.rendered(post, field)
+
+
 settingsClass = settings.Settings(app.config)
 postClass = post.Post(app.config)
 userClass = user.User(app.config)
+pageCache = page_cache.PageCache(app.config)
+# Feeds are polled by readers whether or not they are logged in, so they
+# have their own cache in front of build_feed
+feedCache = page_cache.PageCache(app.config, name='feeds')
+readPreference = None if app.config['READ_PREFERENCE'] == 'primary' else \
+    database.read_preference(app.config['READ_PREFERENCE'])
+
+@app.cli.command('uninstall')
+@click.confirmation_option(prompt='Drop all incidents, users and settings?')
+def uninstall_command():
+    """Drops the blog collections and clears the installed marker."""
+    settingsClass.uninstall()
+    click.echo('Uninstalled, restart the workers to clear their latch.')
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Applies pending data migrations and syncs the MongoDB indexes."""
+    version = migrations.Migrations(app.config, log=click.echo).run()
+    click.echo('Schema version %d.' % version)
+
+
+@app.cli.command('import-csv')
+@click.argument('csv_file', type=click.File('rb'))
+@click.option('--author', required=True, help='Username the incidents are added by.')
+@click.option('--batch-size', default=500, show_default=True)
+def import_csv_command(csv_file, author, batch_size):
+    """Imports incidents from a CSV file in the /install upload layout."""
+    report = importer.CsvImporter(postClass, batch_size).run(csv_file, author)
+    for error in report['errors']:
+        click.echo('Row %d: %s' % (error['row'], error['error']), err=True)
+    click.echo('Imported %d incidents, %d rows failed.'
+               % (report['imported'], len(report['errors'])))
+
+
+@app.cli.command('export')
+@click.argument('output', type=click.File('w'))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)),
+              default='csv', show_default=True)
+def export_command(output, fmt):
+    """Exports all incidents as CSV (re-importable), JSON lines or a STIX bundle."""
+    for chunk in export_chunks(fmt):
+        output.write(chunk)
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    """Recomputes the analytics rollups from all incidents."""
+    counted = postClass.analytics.rebuild()
+    click.echo('Rolled up %d incidents.' % counted)
+
+
+@app.cli.command('backfill-losses')
+@click.option('--batch-size', default=500, show_default=True)
+def backfill_losses_command(batch_size):
+    """Parses the loss text of older incidents into the typed loss fields."""
+    updated = postClass.backfill_losses(batch_size)
+    click.echo('Backfilled %d incidents.' % updated)
+
+
+@app.cli.command('backfill-countries')
+@click.option('--batch-size', default=500, show_default=True)
+def backfill_countries_command(batch_size):
+    """Normalizes the geography of older incidents into country codes."""
+    updated = postClass.backfill_country_codes(batch_size)
+    click.echo('Backfilled %d incidents.' % updated)
+
+
+@app.cli.command('rerender')
+def rerender_command():
+    """Re-renders stored incident HTML after the markdown extensions change."""
+    updated = postClass.rerender_stale()
+    click.echo('Re-rendered %d incidents.' % updated)
+
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Rebuilds the text search index from all incidents."""
+    indexed = postClass.search_index.rebuild(app.config['POSTS_COLLECTION'])
+    click.echo('Indexed %d incidents.' % indexed)
+
 
 app.jinja_env.globals['url_for_other_page'] = url_for_other_page
+app.jinja_env.globals['url_for_cursor'] = url_for_cursor
+app.jinja_env.globals['url_for_facet'] = url_for_facet
+app.jinja_env.globals['csrf_token'] = generate_csrf_token
+# Sidebar data is only queried when a template renders it
+app.jinja_env.globals['recent_posts'] = postClass.get_recent_posts
+app.jinja_env.globals['tags'] = postClass.get_top_tags
 app.jinja_env.globals['meta_description'] = app.config['BLOG_DESCRIPTION']
 
 if not app.config['DEBUG']: